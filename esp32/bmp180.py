@@ -1,4 +1,4 @@
-from helpers import _write_to_i2c
+from helpers import _write_to_i2c, read_calibration_cache, write_calibration_cache
 from machine import I2C
 import struct
 
@@ -7,43 +7,92 @@ import struct
 # and https://github.com/micropython-IMU/micropython-bmp180
 class BMP180:
     i2c_address = 0x77
+    # AC1 to MD are stored back to back from 0xAA, big-endian
+    calibration_register = 0xAA
+    calibration_names = (
+        "AC1",
+        "AC2",
+        "AC3",
+        "AC4",
+        "AC5",
+        "AC6",
+        "VB1",
+        "VB2",
+        "MB",
+        "MC",
+        "MD",
+    )
+    calibration_format = ">hhhHHHhhhhh"
+    calibration_size = 22
+    calibration_cache = "bmp180_calibration.bin"
 
     def __init__(self, i2c_instance: I2C):
         self.i2c_instance = i2c_instance
         self.calibration = {}
 
-    async def init(self):
-        registers = {
-            "AC1": [0xAA, ">h"],
-            "AC2": [0xAC, ">h"],
-            "AC3": [0xAE, ">h"],
-            "AC4": [0xB0, ">H"],
-            "AC5": [0xB2, ">H"],
-            "AC6": [0xB4, ">H"],
-            "VB1": [0xB6, ">h"],
-            "VB2": [0xB8, ">h"],
-            "MB": [0xBA, ">h"],
-            "MC": [0xBC, ">h"],
-            "MD": [0xBE, ">h"],
-        }
-
-        for register_name, register_data in registers.items():
-            i2c_response = await _write_to_i2c(
+    async def init(self, cache_calibration: bool = False):
+        # reads the calibration in one burst, or from the cache on warm boots
+        calibration = cache_key = None
+        if cache_calibration:
+            chip_id = await _write_to_i2c(
+                self.i2c_instance, b"\xd0", i2c_device=self.i2c_address, read_bytes=1
+            )
+            if chip_id is not None:
+                cache_key = chip_id + bytes([self.i2c_address])
+                calibration = read_calibration_cache(
+                    self.calibration_cache, cache_key, self.calibration_size
+                )
+        if calibration is None:
+            calibration = await _write_to_i2c(
                 self.i2c_instance,
-                bytes([register_data[0]]),
+                bytes([self.calibration_register]),
                 i2c_device=self.i2c_address,
-                read_bytes=2,
+                read_bytes=self.calibration_size,
             )
-            self.calibration[register_name] = struct.unpack(
-                register_data[1], i2c_response
-            )[0]
+            # retried already, the readings would be garbage without it
+            if calibration is None:
+                raise OSError("BMP180 calibration read failed")
+            if cache_key is not None:
+                write_calibration_cache(self.calibration_cache, cache_key, calibration)
 
-    def _compute_b5(self, temp_raw):
-        X1 = (temp_raw - self.calibration["AC6"]) * (self.calibration["AC5"]) >> 15
-        X2 = (self.calibration["MC"] << 11) / (X1 + self.calibration["MD"])
+        self.calibration = dict(
+            zip(
+                self.calibration_names,
+                struct.unpack(self.calibration_format, calibration),
+            )
+        )
+
+    def _compute_b5(self, temp_raw: int) -> int:
+        X1 = (temp_raw - self.calibration["AC6"]) * self.calibration["AC5"] >> 15
+        X2 = (self.calibration["MC"] << 11) // (X1 + self.calibration["MD"])
         return X1 + X2
 
-    async def read_temperature(self) -> int:
+    def _compute_pressure(
+        self, pressure_raw: int, B5: int, oversample_mode: int
+    ) -> int:
+        # integer algorithm from the datasheet, section 3.5, in Pa
+        B6 = B5 - 4000
+        B6_squared = (B6 * B6) >> 12
+        X1 = (self.calibration["VB2"] * B6_squared) >> 11
+        X2 = (self.calibration["AC2"] * B6) >> 11
+        X3 = X1 + X2
+        B3 = (((self.calibration["AC1"] * 4 + X3) << oversample_mode) + 2) >> 2
+        X1 = (self.calibration["AC3"] * B6) >> 13
+        X2 = (self.calibration["VB1"] * B6_squared) >> 16
+        X3 = (X1 + X2 + 2) >> 2
+        B4 = (self.calibration["AC4"] * (X3 + 32768)) >> 15
+        B7 = (pressure_raw - B3) * (50000 >> oversample_mode)
+        # the datasheet's ordering to keep B7 * 2 within 32 bits
+        if B7 < 0x80000000:
+            pascal = (B7 * 2) // B4
+        else:
+            pascal = (B7 // B4) * 2
+        X1 = (pascal >> 8) * (pascal >> 8)
+        X1 = (X1 * 3038) >> 16
+        X2 = (-7357 * pascal) >> 16
+        return pascal + ((X1 + X2 + 3791) >> 4)
+
+    async def _read_raw_temperature(self) -> int:
         await _write_to_i2c(
             self.i2c_instance,
             b"\xf4\x2e",
@@ -53,16 +102,26 @@ class BMP180:
         temp_raw = await _write_to_i2c(
             self.i2c_instance, b"\xf6", i2c_device=self.i2c_address, read_bytes=2
         )
-        temp_raw = struct.unpack(">h", temp_raw)[0]
+        if temp_raw is None:
+            return None
+        return struct.unpack(">h", temp_raw)[0]
 
+    async def read_temperature(self) -> float:
+        # None if the sensor couldn't be read
+        temp_raw = await self._read_raw_temperature()
+        if temp_raw is None:
+            return None
         B5 = self._compute_b5(temp_raw)
-        t = int(B5 + 8) >> 4
-        t /= 10
-
-        return t
+        # in 0.1C
+        t = (B5 + 8) >> 4
+        return t / 10
 
     async def read_pressure(self, oversample_mode: int = 3) -> int:
-        temp = await self.read_temperature()
+        # None if the sensor couldn't be read
+        temp_raw = await self._read_raw_temperature()
+        if temp_raw is None:
+            return None
+        B5 = self._compute_b5(temp_raw)
         await _write_to_i2c(
             self.i2c_instance,
             bytes([0xF4, 0x34 + (0x40 * oversample_mode)]),
@@ -72,26 +131,9 @@ class BMP180:
         pressure_raw = await _write_to_i2c(
             self.i2c_instance, b"\xf6", i2c_device=self.i2c_address, read_bytes=3
         )
-        # TODO: improve this
-        B5_raw = (int(temp * 10) << 4) - 8
+        if pressure_raw is None:
+            return None
         UP = ((pressure_raw[0] << 16) + (pressure_raw[1] << 8) + pressure_raw[2]) >> (
             8 - oversample_mode
         )
-        B6 = B5_raw - 4000
-        X1 = (self.calibration["VB2"] * (B6**2 / 2**12)) / 2**11
-        X2 = self.calibration["AC2"] * B6 / 2**11
-        X3 = X1 + X2
-        B3 = ((int((self.calibration["AC1"] * 4 + X3)) << oversample_mode) + 2) / 4
-        X1 = self.calibration["AC3"] * B6 / 2**13
-        X2 = (self.calibration["VB1"] * (B6**2 / 2**12)) / 2**16
-        X3 = ((X1 + X2) + 2) / 2**2
-        B4 = abs(self.calibration["AC4"]) * (X3 + 32768) / 2**15
-        B7 = (abs(UP) - B3) * (50000 >> oversample_mode)
-        if B7 < 0x80000000:
-            pascal = (B7 * 2) / B4
-        else:
-            pascal = (B7 / B4) * 2
-        X1 = (pascal / 2**8) ** 2
-        X1 = (X1 * 3038) / 2**16
-        X2 = (-7357 * pascal) / 2**16
-        return pascal + (X1 + X2 + 3791) / 2**4
+        return self._compute_pressure(UP, B5, oversample_mode)
@@ -1,5 +1,13 @@
 from micropython import const
 from ustruct import unpack as unp
+from helpers import (
+    _write_to_i2c,
+    read_calibration_cache,
+    write_calibration_cache,
+    read_i2c_mem,
+    write_i2c_mem,
+)
+import uasyncio
 
 # Author David Stenwall (david at stenwall.io)
 # Modified by ave (githubpublic at ave.zone)
@@ -100,28 +108,74 @@ _BMP280_REGISTER_CONFIG = const(0xF5)  # IIR filter config
 
 _BMP280_REGISTER_DATA = const(0xF7)
 
+# only ever changed by us, so kept in RAM after the first read or write
+_BMP280_SHADOWED_REGISTERS = (_BMP280_REGISTER_CONTROL, _BMP280_REGISTER_CONFIG)
+# how often a forced measurement is checked on after read_wait_ms, 1ms apart
+_BMP280_FORCED_POLLS = const(10)
+
+# T1-T3 and P1-P9, little-endian, H unsigned short, h signed short
+_BMP280_REGISTER_CALIBRATION = const(0x88)
+_BMP280_CALIBRATION_FORMAT = "<HhhHhhhhhhhh"
+_BMP280_CALIBRATION_SIZE = const(24)
+_BMP280_CALIBRATION_CACHE = "bmp280_calibration.bin"
+
+
+def _shadow_value(address, value):
+    # The chip goes back to sleep by itself after a forced measurement, so
+    # control is shadowed with the mode bits cleared. Otherwise the next
+    # read-modify-write would start another measurement.
+    if address == _BMP280_REGISTER_CONTROL and value & 0x03 in (1, 2):
+        return value & 0xFC
+    return value
+
 
 class BMP280:
-    def __init__(self, i2c_bus, addr=0x76, use_case=BMP280_CASE_HANDHELD_DYN):
+    def __init__(
+        self,
+        i2c_bus,
+        addr=0x76,
+        use_case=BMP280_CASE_HANDHELD_DYN,
+        cache_calibration=False,
+    ):
         self._bmp_i2c = i2c_bus
         self._i2c_addr = addr
-
-        # read calibration data
-        # < little-endian
-        # H unsigned short
-        # h signed short
-        self._T1 = unp("<H", self._read(0x88, 2))[0]
-        self._T2 = unp("<h", self._read(0x8A, 2))[0]
-        self._T3 = unp("<h", self._read(0x8C, 2))[0]
-        self._P1 = unp("<H", self._read(0x8E, 2))[0]
-        self._P2 = unp("<h", self._read(0x90, 2))[0]
-        self._P3 = unp("<h", self._read(0x92, 2))[0]
-        self._P4 = unp("<h", self._read(0x94, 2))[0]
-        self._P5 = unp("<h", self._read(0x96, 2))[0]
-        self._P6 = unp("<h", self._read(0x98, 2))[0]
-        self._P7 = unp("<h", self._read(0x9A, 2))[0]
-        self._P8 = unp("<h", self._read(0x9C, 2))[0]
-        self._P9 = unp("<h", self._read(0x9E, 2))[0]
+        # control and config register values, see _read_register
+        self._shadow = {}
+        # configured for forced mode, read_pressure then starts measurements
+        self._forced = False
+
+        # read calibration data in one burst, or from the cache on warm boots
+        calibration = None
+        if cache_calibration:
+            cache_key = self.chip_id + bytes([addr])
+            calibration = read_calibration_cache(
+                _BMP280_CALIBRATION_CACHE, cache_key, _BMP280_CALIBRATION_SIZE
+            )
+        if calibration is None:
+            calibration = self._read(
+                _BMP280_REGISTER_CALIBRATION, _BMP280_CALIBRATION_SIZE
+            )
+            # _read raises once out of retries, a short read mustn't be cached either
+            if calibration is None or len(calibration) != _BMP280_CALIBRATION_SIZE:
+                raise OSError("BMP280 calibration read failed")
+            if cache_calibration:
+                write_calibration_cache(
+                    _BMP280_CALIBRATION_CACHE, cache_key, calibration
+                )
+        (
+            self._T1,
+            self._T2,
+            self._T3,
+            self._P1,
+            self._P2,
+            self._P3,
+            self._P4,
+            self._P5,
+            self._P6,
+            self._P7,
+            self._P8,
+            self._P9,
+        ) = unp(_BMP280_CALIBRATION_FORMAT, calibration)
 
         # output raw
         self._t_raw = 0
@@ -139,18 +193,30 @@ class BMP280:
             self.use_case(use_case)
 
     def _read(self, addr, size=1):
-        return self._bmp_i2c.readfrom_mem(self._i2c_addr, addr, size)
+        return read_i2c_mem(self._bmp_i2c, self._i2c_addr, addr, size)
 
     def _write(self, addr, b_arr):
         if not type(b_arr) is bytearray:
             b_arr = bytearray([b_arr])
-        return self._bmp_i2c.writeto_mem(self._i2c_addr, addr, b_arr)
+        result = write_i2c_mem(self._bmp_i2c, self._i2c_addr, addr, b_arr)
+        if addr in _BMP280_SHADOWED_REGISTERS:
+            self._shadow[addr] = _shadow_value(addr, b_arr[0])
+        return result
+
+    def _read_register(self, address):
+        if address in self._shadow:
+            return self._shadow[address]
+        d = self._read(address)[0]
+        if address in _BMP280_SHADOWED_REGISTERS:
+            self._shadow[address] = d
+        return d
 
     def _gauge(self):
         # TODO limit new reads
         # read all data at once (as by spec)
-        d = self._read(_BMP280_REGISTER_DATA, 6)
+        self._parse_data(self._read(_BMP280_REGISTER_DATA, 6))
 
+    def _parse_data(self, d):
         self._p_raw = (d[0] << 12) + (d[1] << 4) + (d[2] >> 4)
         self._t_raw = (d[3] << 12) + (d[4] << 4) + (d[5] >> 4)
 
@@ -160,6 +226,7 @@ class BMP280:
 
     def reset(self):
         self._write(_BMP280_REGISTER_RESET, 0xB6)
+        self._shadow = {}
 
     def load_test_calibration(self):
         self._T1 = 27504
@@ -194,8 +261,11 @@ class BMP280:
         print("P9: {} {}".format(self._P9, type(self._P9)))
 
     def _calc_t_fine(self):
-        # From datasheet page 22
         self._gauge()
+        self._calc_t_fine_from_raw()
+
+    def _calc_t_fine_from_raw(self):
+        # From datasheet page 22
         if self._t_fine == 0:
             var1 = (((self._t_raw >> 3) - (self._T1 << 1)) * self._T2) >> 11
             var2 = (
@@ -247,14 +317,14 @@ class BMP280:
         return self._pressure(t_fine)
 
     def _write_bits(self, address, value, length, shift=0):
-        d = self._read(address)[0]
+        d = self._read_register(address)
         m = int("1" * length, 2) << shift
         d &= ~m
         d |= m & value << shift
         self._write(address, d)
 
     def _read_bits(self, address, length, shift=0):
-        d = self._read(address)[0]
+        d = self._read_register(address)
         return d >> shift & int("1" * length, 2)
 
     @property
@@ -347,3 +417,74 @@ class BMP280:
         assert 0 <= oss <= 4
         p_os, t_os, self.read_wait_ms = _BMP280_OS_MATRIX[oss]
         self._write_bits(_BMP280_REGISTER_CONTROL, p_os + (t_os << 3), 2)
+
+    # The async API below goes through _write_to_i2c, so it yields to other
+    # tasks during bus waits and measurements, and only writes control and
+    # config, never reading them back.
+
+    async def _read_async(self, address, size=1):
+        # None if the sensor couldn't be read
+        return await _write_to_i2c(
+            self._bmp_i2c,
+            bytes([address]),
+            i2c_device=self._i2c_addr,
+            read_bytes=size,
+            command_wait_s=0,
+        )
+
+    async def _write_async(self, address, value):
+        await _write_to_i2c(
+            self._bmp_i2c,
+            bytes([address, value]),
+            i2c_device=self._i2c_addr,
+            command_wait_s=0,
+        )
+        if address in _BMP280_SHADOWED_REGISTERS:
+            self._shadow[address] = _shadow_value(address, value)
+
+    async def configure(self, uc, power_mode=None):
+        # use_case, optionally with a different power mode, in two writes
+        assert 0 <= uc <= 5
+        pm, oss, iir, sb = _BMP280_CASE_MATRIX[uc]
+        if power_mode is not None:
+            pm = power_mode
+        self._forced = pm == BMP280_POWER_FORCED
+        p_os, t_os, self.read_wait_ms = _BMP280_OS_MATRIX[oss]
+        await self._write_async(_BMP280_REGISTER_CONFIG, (iir << 2) + (sb << 5))
+        await self._write_async(
+            _BMP280_REGISTER_CONTROL, pm + (p_os << 2) + (t_os << 5)
+        )
+
+    async def _measure_forced(self):
+        # starts a forced measurement and sleeps until it's done, returns
+        # False if it couldn't be started
+        control = self._shadow[_BMP280_REGISTER_CONTROL]
+        try:
+            await self._write_async(
+                _BMP280_REGISTER_CONTROL, (control & 0xFC) | BMP280_POWER_FORCED
+            )
+        except OSError:
+            return False
+        await uasyncio.sleep_ms(self.read_wait_ms)
+        for _ in range(_BMP280_FORCED_POLLS):
+            status = await self._read_async(_BMP280_REGISTER_STATUS)
+            if status is not None and not status[0] & 0x08:
+                break
+            await uasyncio.sleep_ms(1)
+        return True
+
+    async def read_pressure(self, celsius=None):
+        # Pressure in Pa, compensated with celsius if given, as the use cases
+        # skip temperature measurements. Measures first in forced mode, in
+        # normal mode reads the latest measurement. None if it couldn't be read.
+        if self._forced:
+            if not await self._measure_forced():
+                return None
+        d = await self._read_async(_BMP280_REGISTER_DATA, 6)
+        if d is None:
+            return None
+        self._parse_data(d)
+        if celsius is None:
+            self._calc_t_fine_from_raw()
+            return self._pressure(self._t_fine)
+        return self._pressure(int((int(celsius * 100) << 8) / 5))
@@ -1,12 +1,13 @@
 from machine import I2C, lightsleep, Pin
+from array import array
 import json
 import utime
 import machine
 import network
+import ntptime
 import uasyncio
 import ubinascii
 
-
 with open("config.json") as f:
     config = json.load(f)
 
@@ -17,6 +18,40 @@ if config["pins"].get("wlan"):
 
 DATA_FORMAT_ID = {"co2": 0, "c": 1, "rh": 2, "pressure": 3}
 
+# config changes reset the board, so this is fixed for the whole run. Hot
+# paths check it before building debug_print's arguments.
+DEBUG_LEVEL = config["debug"]
+# ring buffer of the enabled debug output, see read_debug_log
+debug_log = bytearray(config.get("debug_log_bytes", 2048) if DEBUG_LEVEL else 0)
+debug_log_pos = 0
+debug_log_wrapped = False
+
+# how many times each class of I2C transaction is retried, "once" never is
+I2C_RETRIES = config["i2c"].get("retries", {"read": 2, "write": 2})
+# doubled on each retry
+I2C_RETRY_BACKOFF_MS = config["i2c"].get("retry_backoff_ms", 5)
+# upper bounds of the latency histogram, the last bucket catches the rest
+I2C_LATENCY_BUCKETS_US = (250, 500, 1000, 2000, 5000, 10000)
+# per device address, the counters below followed by the latency histogram
+i2c_stats = {}
+_I2C_TRANSACTIONS = 0
+_I2C_ERRORS = 1
+_I2C_RETRIES = 2
+_I2C_FAILURES = 3
+_I2C_LATENCY = 4
+
+# fast_pressure_to_altitude's table covers the pressure sensors' range, one
+# entry in cm every 256Pa, for SEA_LEVEL_PA unless asked for another
+SEA_LEVEL_PA = round(config.get("sea_level_hpa", 1013.25) * 100)
+ALTITUDE_TABLE_MIN_PA = 30000
+ALTITUDE_TABLE_MAX_PA = 110000
+ALTITUDE_TABLE_STEP_SHIFT = 8
+altitude_table = None
+altitude_table_sea_level_pa = None
+
+# set once sync_clock has set the RTC from NTP
+clock_synced = False
+
 
 if config["bluetooth"]["enabled"]:
     bt_pin = Pin(config["pins"]["bt"], Pin.IN, Pin.PULL_UP)
@@ -117,9 +152,36 @@ async def appropriate_async_sleep(duration_s: int):
 
 
 def debug_print(*args, log_level=1):
-    if log_level > config["debug"]:
+    if log_level > DEBUG_LEVEL:
         return
     print(*args)
+    if debug_log:
+        _append_debug_log((" ".join([str(arg) for arg in args]) + "\n").encode())
+
+
+def _append_debug_log(line: bytes):
+    global debug_log_pos, debug_log_wrapped
+
+    # only the end of lines longer than the whole buffer is kept
+    line = line[-len(debug_log) :]
+    end = debug_log_pos + len(line)
+    if end <= len(debug_log):
+        debug_log[debug_log_pos:end] = line
+    else:
+        split = len(debug_log) - debug_log_pos
+        debug_log[debug_log_pos:] = line[:split]
+        debug_log[: end - len(debug_log)] = line[split:]
+    if end >= len(debug_log):
+        debug_log_wrapped = True
+    debug_log_pos = end % len(debug_log)
+
+
+def read_debug_log() -> bytes:
+    # oldest output first, starting from the first whole line once wrapped
+    if not debug_log_wrapped:
+        return bytes(debug_log[:debug_log_pos])
+    log = bytes(debug_log[debug_log_pos:]) + bytes(debug_log[:debug_log_pos])
+    return log[log.find(b"\n") + 1 :]
 
 
 def set_cpu_freq_by_config():
@@ -138,33 +200,236 @@ async def ensure_wlan_connected(wlan: network.WLAN) -> bool:
 
             wlan.connect(config["wlan"]["ssid"], config["wlan"]["password"])
             await appropriate_async_sleep(config["wlan"]["connection_wait_s"])
+        if not clock_synced:
+            sync_clock()
         return True
     except Exception as e:
         debug_print("Handled wifi error:", e)
         return False
 
 
+def sync_clock():
+    # The RTC counts from its epoch again on every boot, the logs' timestamps
+    # only say when a reading was taken once this has set it. Tried again on
+    # the next connection if the server doesn't answer.
+    global clock_synced
+
+    try:
+        ntptime.settime()
+    except OSError as e:
+        debug_print("Couldn't set the clock:", e)
+        return
+    clock_synced = True
+    debug_print("Clock set to", utime.time())
+
+
+def _i2c_device_stats(i2c_device: int) -> list:
+    if i2c_device not in i2c_stats:
+        i2c_stats[i2c_device] = [0] * (_I2C_LATENCY + len(I2C_LATENCY_BUCKETS_US) + 1)
+    return i2c_stats[i2c_device]
+
+
+def _record_i2c_latency(stats: list, bus_us: int):
+    bucket = 0
+    while bucket < len(I2C_LATENCY_BUCKETS_US) and (
+        bus_us > I2C_LATENCY_BUCKETS_US[bucket]
+    ):
+        bucket += 1
+    stats[_I2C_LATENCY + bucket] += 1
+
+
 async def _write_to_i2c(
     i2c_instance: I2C,
     command: bytes,
     i2c_device: int = 0x62,
     read_bytes: int = 0,
     command_wait_s: int = 0.001,
+    retry_class: str | None = None,
+    destructive_read: bool = False,
 ):
-    debug_print(">", i2c_device, ubinascii.hexlify(command).decode(), log_level=2)
-    i2c_instance.writeto(i2c_device, command)
-    await uasyncio.sleep(command_wait_s)
-    if read_bytes:
+    # Sends command, waits command_wait_s and reads read_bytes back if asked.
+    # The whole transaction is retried as I2C_RETRIES allows for retry_class,
+    # by default "read" if reading and "write" if not. Once out of retries,
+    # returns None for reads and raises the bus error for writes.
+    # destructive_read is for commands that empty what they read, like the
+    # SCD41's read_measurement, once sent successfully only the read is retried.
+    if retry_class is None:
+        retry_class = "read" if read_bytes else "write"
+    stats = _i2c_device_stats(i2c_device)
+    stats[_I2C_TRANSACTIONS] += 1
+    read_data = None
+    command_sent = False
+
+    for attempt in range(I2C_RETRIES.get(retry_class, 0) + 1):
+        if attempt:
+            stats[_I2C_RETRIES] += 1
+            await uasyncio.sleep_ms(I2C_RETRY_BACKOFF_MS << (attempt - 1))
+        if DEBUG_LEVEL >= 2:
+            debug_print(
+                ">", i2c_device, ubinascii.hexlify(command).decode(), log_level=2
+            )
         try:
-            read_data = i2c_instance.readfrom(i2c_device, read_bytes)
+            bus_us = 0
+            if not command_sent:
+                start_us = utime.ticks_us()
+                i2c_instance.writeto(i2c_device, command)
+                bus_us = utime.ticks_diff(utime.ticks_us(), start_us)
+                command_sent = destructive_read
+                await uasyncio.sleep(command_wait_s)
+            if read_bytes:
+                start_us = utime.ticks_us()
+                read_data = i2c_instance.readfrom(i2c_device, read_bytes)
+                bus_us += utime.ticks_diff(utime.ticks_us(), start_us)
+        except OSError as e:
+            stats[_I2C_ERRORS] += 1
+            error = e
+            debug_print("Handled I2C error:", e, "on command", command)
+            continue
+
+        _record_i2c_latency(stats, bus_us)
+        if read_bytes and DEBUG_LEVEL >= 2:
             debug_print(
                 "<", i2c_device, ubinascii.hexlify(read_data).decode(), log_level=2
             )
-            return read_data
+        return read_data
+
+    stats[_I2C_FAILURES] += 1
+    if not read_bytes:
+        raise error
+
+
+def _i2c_mem_transaction(transfer, i2c_device: int, retry_class: str):
+    # The blocking counterpart of _write_to_i2c for register based drivers,
+    # raises the bus error once out of retries.
+    stats = _i2c_device_stats(i2c_device)
+    stats[_I2C_TRANSACTIONS] += 1
+
+    for attempt in range(I2C_RETRIES.get(retry_class, 0) + 1):
+        if attempt:
+            stats[_I2C_RETRIES] += 1
+            utime.sleep_ms(I2C_RETRY_BACKOFF_MS << (attempt - 1))
+        try:
+            start_us = utime.ticks_us()
+            result = transfer()
+            bus_us = utime.ticks_diff(utime.ticks_us(), start_us)
         except OSError as e:
-            debug_print("Handled read error:", e, "on command", command)
+            stats[_I2C_ERRORS] += 1
+            error = e
+            debug_print("Handled I2C error:", e, "on device", i2c_device)
+            continue
+
+        _record_i2c_latency(stats, bus_us)
+        return result
+
+    stats[_I2C_FAILURES] += 1
+    raise error
+
+
+def read_i2c_mem(i2c_instance: I2C, i2c_device: int, register: int, size: int):
+    return _i2c_mem_transaction(
+        lambda: i2c_instance.readfrom_mem(i2c_device, register, size),
+        i2c_device,
+        "read",
+    )
+
+
+def write_i2c_mem(i2c_instance: I2C, i2c_device: int, register: int, data: bytes):
+    return _i2c_mem_transaction(
+        lambda: i2c_instance.writeto_mem(i2c_device, register, data),
+        i2c_device,
+        "write",
+    )
+
+
+def i2c_stats_status() -> dict:
+    # flat i2c_<address>_<counter> keys for the web server's status, the
+    # latency histogram as cumulative buckets like prometheus' le
+    status = {}
+    for i2c_device, stats in i2c_stats.items():
+        prefix = "i2c_{:02x}_".format(i2c_device)
+        status[prefix + "transactions"] = stats[_I2C_TRANSACTIONS]
+        status[prefix + "errors"] = stats[_I2C_ERRORS]
+        status[prefix + "retries"] = stats[_I2C_RETRIES]
+        status[prefix + "failures"] = stats[_I2C_FAILURES]
+        cumulative = 0
+        for bucket, bucket_us in enumerate(I2C_LATENCY_BUCKETS_US):
+            cumulative += stats[_I2C_LATENCY + bucket]
+            status[prefix + "latency_le_{}us".format(bucket_us)] = cumulative
+        status[prefix + "latency_le_inf"] = cumulative + stats[-1]
+    return status
+
+
+def i2c_stats_json() -> bytes:
+    # compact form for BLE: the bucket bounds, and per address the counters
+    # followed by the latency histogram
+    return json.dumps(
+        {
+            "buckets_us": I2C_LATENCY_BUCKETS_US,
+            "counters": ("transactions", "errors", "retries", "failures"),
+            "devices": {
+                "{:02x}".format(i2c_device): stats
+                for i2c_device, stats in i2c_stats.items()
+            },
+        }
+    ).encode()
+
+
+def read_calibration_cache(filename: str, key: bytes, size: int) -> bytes | None:
+    # returns the cached calibration block if it was stored under the same key
+    try:
+        with open(filename, "rb") as f:
+            cached = f.read()
+    except OSError:
+        return None
+    if len(cached) != len(key) + size or cached[: len(key)] != key:
+        return None
+    return cached[len(key) :]
+
+
+def write_calibration_cache(filename: str, key: bytes, calibration: bytes):
+    with open(filename, "wb") as f:
+        f.write(key + calibration)
 
 
 def pressure_to_altitude(atmospheric_mbar: float, sea_level_mbar: float = 1013.25):
     # https://github.com/adafruit/Adafruit_BMP085_Unified/blob/master/Adafruit_BMP085_U.cpp#L361
     return 44330.0 * (1.0 - ((atmospheric_mbar / sea_level_mbar) ** 0.1903))
+
+
+def _build_altitude_table(sea_level_pa: int):
+    global altitude_table, altitude_table_sea_level_pa
+
+    step = 1 << ALTITUDE_TABLE_STEP_SHIFT
+    altitude_table = array(
+        "i",
+        (
+            round(pressure_to_altitude(pressure_pa / 100, sea_level_pa / 100) * 100)
+            for pressure_pa in range(
+                ALTITUDE_TABLE_MIN_PA, ALTITUDE_TABLE_MAX_PA + 2 * step, step
+            )
+        ),
+    )
+    altitude_table_sea_level_pa = sea_level_pa
+
+
+def fast_pressure_to_altitude(pressure_pa: float, sea_level_pa: int | None = None):
+    # pressure_to_altitude by linear interpolation over a table, in integer
+    # maths. Stays within 0.15m of it between ALTITUDE_TABLE_MIN_PA and
+    # ALTITUDE_TABLE_MAX_PA, mostly from rounding to whole Pa, see
+    # tools/altitude_benchmark.py.
+    if sea_level_pa is None:
+        sea_level_pa = SEA_LEVEL_PA
+    if sea_level_pa != altitude_table_sea_level_pa:
+        _build_altitude_table(sea_level_pa)
+
+    offset = round(pressure_pa) - ALTITUDE_TABLE_MIN_PA
+    if not 0 <= offset <= ALTITUDE_TABLE_MAX_PA - ALTITUDE_TABLE_MIN_PA:
+        return pressure_to_altitude(pressure_pa / 100, sea_level_pa / 100)
+
+    index = offset >> ALTITUDE_TABLE_STEP_SHIFT
+    fraction = offset & ((1 << ALTITUDE_TABLE_STEP_SHIFT) - 1)
+    altitude_cm = altitude_table[index]
+    altitude_cm += (
+        (altitude_table[index + 1] - altitude_cm) * fraction
+    ) >> ALTITUDE_TABLE_STEP_SHIFT
+    return altitude_cm / 100
@@ -5,10 +5,16 @@ INFLUX_WRITE_URL = f"{config['influx']['host']}/api/v2/write?bucket={config['inf
 
 
 def send_metrics_to_influx(co2, temp, rh):
+    # co2 is None for temperature and humidity only readings
+    fields = (
+        f"temp={temp},humidity={rh}"
+        if co2 is None
+        else f"co2={co2},temp={temp},humidity={rh}"
+    )
     try:
         res = urequests.post(
             INFLUX_WRITE_URL,
-            data=f"{config['influx']['datapoint']} co2={co2},temp={temp},humidity={rh}",
+            data=f"{config['influx']['datapoint']} {fields}",
         )
         debug_print("ureq status:", res.status_code)
         res.close()
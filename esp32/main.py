@@ -1,11 +1,14 @@
 from machine import I2C, SoftI2C, Pin
 import gc
 import uos
-import utime
 import machine
 import network
 from helpers import (
     debug_print,
+    read_debug_log,
+    DEBUG_LEVEL,
+    i2c_stats_status,
+    i2c_stats_json,
     appropriate_sleep,
     appropriate_async_sleep,
     ensure_wlan_connected,
@@ -14,10 +17,19 @@ from helpers import (
     update_config,
     wlan_enabled,
     bt_enabled,
-    pressure_to_altitude,
+    fast_pressure_to_altitude,
     set_cpu_freq_by_config,
 )
 from influx_helpers import send_metrics_to_influx
+from sensor_log import (
+    LOG_COMBINED,
+    CombinedLog,
+    open_log,
+    flush_due_logs,
+    flush_logs,
+    log_stats_status,
+    log_stats_json,
+)
 from web_server import set_webserver_status_data
 from scd41 import SCD41
 
@@ -56,7 +68,7 @@ use_bmp280 = 0x76 in i2c_peripherals
 if use_bmp180:
     from bmp180 import BMP180
 if use_bmp280:
-    from bmp280 import BMP280
+    from bmp280 import BMP280, BMP280_POWER_FORCED, BMP280_POWER_NORMAL
 
 if config["bluetooth"]["enabled"]:
     import aioble
@@ -130,6 +142,13 @@ async def bluetooth_task():
             continue
 
 
+async def _write_complex_comms_reply(reply: bytes):
+    # the reply is kept until the client writes back
+    complex_comms_characteristic.write(reply)
+    while complex_comms_characteristic.read() == reply:
+        await uasyncio.sleep(1)
+
+
 async def bt_complex_comms_task():
     scd41 = SCD41(i2c)
     while True:
@@ -142,9 +161,21 @@ async def bt_complex_comms_task():
         debug_print("got complex command:", characteristic_data)
 
         if characteristic_data == b"reset":
+            # in single shot mode the sensor sleeps between readings and
+            # wouldn't acknowledge the stop
+            if config["scd41"].get("single_shot_interval_min", 0):
+                await scd41.wake_up()
             await scd41.stop_periodic_measurement()
             await scd41.perform_factory_reset()
+            flush_logs()
             machine.reset()
+        elif characteristic_data == b"debug_log":
+            # the newest output that fits
+            await _write_complex_comms_reply(read_debug_log()[-512:] or b"empty")
+        elif characteristic_data == b"i2c_stats":
+            await _write_complex_comms_reply(i2c_stats_json()[:512])
+        elif characteristic_data == b"log_stats":
+            await _write_complex_comms_reply(log_stats_json()[:512])
 
 
 async def bmp180_task(
@@ -158,7 +189,10 @@ async def bmp180_task(
         else config["bmp180"]["oversampling"]
     )
     pressure_pa = await bmp180_inst.read_pressure(oversample_mode=oversampling_level)
-    elevation_m = pressure_to_altitude(pressure_pa / 100)
+    if pressure_pa is None:
+        debug_print("Couldn't read pressure")
+        return None, None
+    elevation_m = fast_pressure_to_altitude(pressure_pa)
 
     debug_print(
         "pressure Pa:",
@@ -190,8 +224,11 @@ async def bmp280_task(
     bmp280_inst: BMP280, scd41_inst: SCD41, temperature: float
 ) -> (float, float):
     temp_offset = config["scd41"].get("temp_offset", 4)
-    pressure_pa = bmp280_inst.pressure_with_ext_temp(temperature + temp_offset)
-    elevation_m = pressure_to_altitude(pressure_pa / 100)
+    pressure_pa = await bmp280_inst.read_pressure(celsius=temperature + temp_offset)
+    if pressure_pa is None:
+        debug_print("Couldn't read pressure")
+        return None, None
+    elevation_m = fast_pressure_to_altitude(pressure_pa)
 
     debug_print(
         "pressure Pa:",
@@ -223,17 +260,31 @@ async def sensor_task():
     scd41 = SCD41(i2c)
     if use_bmp180:
         bmp180 = BMP180(i2c)
-        await bmp180.init()
+        await bmp180.init(
+            cache_calibration=config["bmp180"].get("cache_calibration", False)
+        )
     elif use_bmp280:
-        bmp280 = BMP280(i2c)
+        bmp280 = BMP280(
+            i2c,
+            use_case=None,
+            cache_calibration=config["bmp280"].get("cache_calibration", False),
+        )
         bmp_usecase = (
             config["bmp280"]["usecase_wlan"]
             if wlan_enabled()
             else config["bmp280"]["usecase"]
         )
-        bmp280.use_case(bmp_usecase)
-        bmp280.normal_measure()
-    # account for hot restarts
+        # forced mode only measures when read and sleeps in between
+        await bmp280.configure(
+            bmp_usecase,
+            power_mode=(
+                BMP280_POWER_FORCED
+                if config["bmp280"].get("forced_mode", False)
+                else BMP280_POWER_NORMAL
+            ),
+        )
+    # account for hot restarts, the sensor may be asleep from single shot mode
+    await scd41.wake_up()
     await scd41.stop_periodic_measurement()
 
     serial_number = await scd41.get_serial_number()
@@ -260,29 +311,45 @@ async def sensor_task():
     debug_print("self test result:", self_test_result)
     # TODO: act on self test maybe?
 
-    log_files = {}
+    # 0 keeps the sensor in periodic measurement
+    single_shot_interval_s = int(
+        config["scd41"].get("single_shot_interval_min", 0) * 60
+    )
+    single_shot_rht_only = config["scd41"].get("single_shot_rht_only", False)
 
-    for log_entry in config["logs"]:
-        log_files[log_entry] = open(f"logs/{log_entry}.log", "ab")
-        log_files[log_entry].write(
-            b"AN42"
-            + bytes([DATA_FORMAT_ID[log_entry], int(config["scd41"]["low_power"])])
-        )
-        # pressure is 3 bytes per datapoint
-        if log_entry == "pressure":
-            log_files[log_entry].write(b"\x00")
+    if single_shot_interval_s:
+        log_interval_s = single_shot_interval_s
+    else:
+        # low power mode measures every 30s, normal mode every 5s
+        log_interval_s = 30 if config["scd41"]["low_power"] else 5
+
+    log_files = {}
+    combined_log = None
+
+    if LOG_COMBINED and config["logs"]:
+        combined_log = CombinedLog(open_log("combined"), log_interval_s)
+        for log_entry in config["logs"]:
+            log_files[log_entry] = combined_log.channel(DATA_FORMAT_ID[log_entry])
+    else:
+        for log_entry in config["logs"]:
+            log_files[log_entry] = open_log(log_entry)
+            log_files[log_entry].start_session(
+                DATA_FORMAT_ID[log_entry], log_interval_s
+            )
 
-    await scd41.start_periodic_measurement(low_power=config["scd41"]["low_power"])
+    if single_shot_interval_s:
+        await scd41.start_single_shot_schedule(single_shot_interval_s * 1000)
+    else:
+        await scd41.start_periodic_measurement(low_power=config["scd41"]["low_power"])
 
     if config["screen"]["enabled"]:
         waveshare213.init_display()
-        waveshare213.draw_display_booting()
+        await waveshare213.draw_display_booting_async()
 
     low_power_bytes = bytes([int(config["scd41"]["low_power"])])
     if config.get("history_size"):
         historic_co2_data = low_power_bytes + bytes(config["history_size"] * 2)
 
-    last_run = utime.ticks_ms() / 1000
     screen_refresh_wait = 1
     celsius = None
 
@@ -290,21 +357,24 @@ async def sensor_task():
         # running GC regularly manually is recommended
         # https://docs.micropython.org/en/latest/reference/speed_python.html#controlling-gc
         gc.collect()
-        debug_print("free mem:", gc.mem_free())
-
-        debug_print("wlan:", wlan_enabled(), "bt:", bt_enabled())
+        if DEBUG_LEVEL:
+            debug_print("free mem:", gc.mem_free())
+            debug_print("wlan:", wlan_enabled(), "bt:", bt_enabled())
         wlan.active(wlan_enabled())
 
+        # sleeps until the next measurement is ready
+        await scd41.wait_for_data_ready()
+
         if use_bmp180:
             pressure_pa, elevation_m = await bmp180_task(bmp180, scd41)
-            if "pressure" in log_files:
+            if "pressure" in log_files and pressure_pa is not None:
                 # drop the first byte, always 0
                 log_files["pressure"].write(
                     struct.pack(">I", int(pressure_pa * 10))[1:]
                 )
         elif use_bmp280 and (celsius is not None):
             pressure_pa, elevation_m = await bmp280_task(bmp280, scd41, celsius)
-            if "pressure" in log_files:
+            if "pressure" in log_files and pressure_pa is not None:
                 # drop the first byte, always 0
                 log_files["pressure"].write(
                     struct.pack(">I", int(pressure_pa * 10))[1:]
@@ -312,17 +382,23 @@ async def sensor_task():
         else:
             pressure_pa = elevation_m = None
 
-        while not await scd41.get_data_ready_status():
-            await appropriate_async_sleep(1)
-
-        (
-            measurement_status,
-            co2,
-            celsius,
-            relative_humidity,
-        ) = await scd41.read_measurement()
-
-        if config.get("history_size"):
+        if single_shot_interval_s:
+            (
+                measurement_status,
+                co2,
+                celsius,
+                relative_humidity,
+            ) = await scd41.read_single_shot(rht_only=single_shot_rht_only)
+        else:
+            (
+                measurement_status,
+                co2,
+                celsius,
+                relative_humidity,
+            ) = await scd41.read_measurement()
+
+        # co2 is None for temperature and humidity only single shots
+        if config.get("history_size") and co2 is not None:
             historic_co2_data = (
                 low_power_bytes
                 + historic_co2_data[(config["history_size"] * -2) + 2 :]
@@ -330,7 +406,7 @@ async def sensor_task():
             )
 
         if measurement_status:
-            if "co2" in log_files:
+            if "co2" in log_files and co2 is not None:
                 log_files["co2"].write(struct.pack(">H", co2))
             if "c" in log_files:
                 log_files["c"].write(struct.pack(">H", int(celsius * 100)))
@@ -338,14 +414,15 @@ async def sensor_task():
                 log_files["rh"].write(struct.pack(">H", int(relative_humidity * 100)))
 
             if config["bluetooth"]["enabled"]:
-                co2_characteristic.write(
-                    (
-                        str(co2).encode()
-                        if config["bluetooth"].get("co2_as_string", False)
-                        else struct.pack("<H", co2)
-                    ),
-                    send_update=True,
-                )
+                if co2 is not None:
+                    co2_characteristic.write(
+                        (
+                            str(co2).encode()
+                            if config["bluetooth"].get("co2_as_string", False)
+                            else struct.pack("<H", co2)
+                        ),
+                        send_update=True,
+                    )
                 temp_characteristic.write(
                     struct.pack("<H", int(celsius * 100)), send_update=True
                 )
@@ -359,12 +436,16 @@ async def sensor_task():
                 "co2_trigger_wlan" if wlan_enabled() else "co2_trigger"
             ]
 
-            if led_co2_trigger_value != -1 and config["pins"].get("led"):
+            if (
+                led_co2_trigger_value != -1
+                and config["pins"].get("led")
+                and co2 is not None
+            ):
                 led_pin.value(int(co2 >= led_co2_trigger_value))
 
             # Only refresh the screen every x cycles
             if config["screen"]["enabled"] and screen_refresh_wait == 0:
-                waveshare213.draw_display(
+                await waveshare213.draw_display_async(
                     co2,
                     celsius,
                     relative_humidity,
@@ -384,34 +465,34 @@ async def sensor_task():
 
             if await ensure_wlan_connected(wlan):
                 if config["webserver"]["enabled"]:
-                    await set_webserver_status_data(
-                        {
-                            "co2_ppm": co2,
-                            "temp_celsius": celsius,
-                            "relative_humidity": relative_humidity,
-                            "pressure_pa": pressure_pa,
-                            "elevation_m": elevation_m,
-                        }
-                    )
+                    status_data = {
+                        "co2_ppm": co2,
+                        "temp_celsius": celsius,
+                        "relative_humidity": relative_humidity,
+                        "pressure_pa": pressure_pa,
+                        "elevation_m": elevation_m,
+                        "scd41_lost_measurements": scd41.lost_measurements,
+                        "screen_skipped_refreshes": (
+                            waveshare213.skipped_refreshes
+                            if config["screen"]["enabled"]
+                            else None
+                        ),
+                    }
+                    status_data.update(i2c_stats_status())
+                    status_data.update(log_stats_status())
+                    await set_webserver_status_data(status_data)
                 if config["influx"].get("enabled", False):
                     send_metrics_to_influx(co2, celsius, relative_humidity)
 
-        total_sleep_time = 30 if config["scd41"]["low_power"] else 5
-        current_ticks_s = utime.ticks_ms() / 1000
-        sleep_duration = total_sleep_time - (current_ticks_s % total_sleep_time)
-
-        # don't sleep if we've overshot our 5/30s
-        if current_ticks_s - last_run > total_sleep_time:
-            sleep_duration = 0
-
-        last_run = utime.ticks_ms() / 1000
-        debug_print("Sleeping for", sleep_duration, "seconds")
-
-        await appropriate_async_sleep(sleep_duration)
+        if combined_log:
+            combined_log.end_record()
+        flush_due_logs()
 
         if config["bluetooth"]["enabled"]:
             config_changes = config_characteristic.read()
             if config_changes:
+                # update_config resets the board
+                flush_logs()
                 await update_config(config_changes)
 
 
@@ -423,7 +504,11 @@ async def main():
     if config["bluetooth"]["enabled"]:
         tasks.append(uasyncio.create_task(bluetooth_task()))
         tasks.append(uasyncio.create_task(bt_complex_comms_task()))
-    await uasyncio.gather(*tasks)
+    try:
+        await uasyncio.gather(*tasks)
+    finally:
+        # keep what's buffered if a task crashes
+        flush_logs()
 
 
 uasyncio.run(main())
@@ -1,32 +1,125 @@
-from helpers import _write_to_i2c, debug_print
+from helpers import (
+    _write_to_i2c,
+    appropriate_async_sleep,
+    debug_print,
+    config,
+    DEBUG_LEVEL,
+)
 from machine import I2C
 import math
 import struct
+import uasyncio
+import utime
 
 
-def _calc_crc8(data: bytes) -> int:
-    crc = 0xFF
-    for data_byte in data:
-        crc ^= data_byte
+def _build_crc8_table() -> bytes:
+    # CRC-8, polynomial 0x31, see the SCD41 datasheet 3.11
+    table = bytearray(256)
+    for index in range(256):
+        crc = index
         for _ in range(8):
             if crc & 0x80:
                 crc = (crc << 1) ^ 0x31
             else:
                 crc = crc << 1
-    # return the first byte
-    return crc & 0xFF
+        table[index] = crc & 0xFF
+    return bytes(table)
+
+
+_CRC8_TABLE = _build_crc8_table()
+
+# how many times a getter is repeated if its CRC doesn't match. Not
+# read_measurement, its data is gone once read.
+CRC_RETRIES = config["scd41"].get("crc_retries", 2)
+# reads that came back with a bad CRC, retries included
+crc_failures = 0
+
+# how long to wait between data ready checks once a predicted reading is late
+DATA_READY_POLL_S = 0.25
+
+
+def _calc_crc8(data: bytes) -> int:
+    crc = 0xFF
+    for data_byte in data:
+        crc = _CRC8_TABLE[crc ^ data_byte]
+    return crc
+
+
+def _check_crc8(response: bytes) -> bool:
+    # responses are 2 byte words, each followed by its CRC
+    for word_start in range(0, len(response), 3):
+        if (
+            _calc_crc8(response[word_start : word_start + 2])
+            != response[word_start + 2]
+        ):
+            return False
+    return True
 
 
 class SCD41:
     def __init__(self, i2c_instance: I2C):
         self.i2c_instance = i2c_instance
+        # periodic measurement schedule, see wait_for_data_ready
+        self.measurement_interval_ms = None
+        self.next_data_ready_ticks = None
+        self.data_ready_misses = 0
+        # readings that couldn't be read intact, see read_measurement
+        self.lost_measurements = 0
+        self.single_shot = False
+
+    async def _read_words(
+        self,
+        command: bytes,
+        word_count: int = 1,
+        command_wait_s: float = 0.001,
+        retries: int = CRC_RETRIES,
+        retry_class: str = "read",
+        destructive_read: bool = False,
+    ):
+        # Sends command and reads word_count CRC-checked words, with the CRCs
+        # left in. Returns None if no attempt came back intact.
+        global crc_failures
+
+        for attempt in range(retries + 1):
+            response = await _write_to_i2c(
+                self.i2c_instance,
+                command,
+                read_bytes=word_count * 3,
+                command_wait_s=command_wait_s,
+                retry_class=retry_class,
+                destructive_read=destructive_read,
+            )
+            # bus errors have already been retried by _write_to_i2c
+            if response is None:
+                return None
+            if _check_crc8(response):
+                return response
+            crc_failures += 1
+            debug_print("CRC mismatch on command", command, "attempt", attempt)
+        return None
 
     async def start_periodic_measurement(self, low_power: bool = False):
         command = b"\x21\xac" if low_power else b"\x21\xb1"
         await _write_to_i2c(self.i2c_instance, command)
+        # low power mode measures every 30s, normal mode every 5s
+        self.measurement_interval_ms = 30000 if low_power else 5000
+        self.next_data_ready_ticks = utime.ticks_add(
+            utime.ticks_ms(), self.measurement_interval_ms
+        )
 
     async def stop_periodic_measurement(self):
         await _write_to_i2c(self.i2c_instance, b"\x3f\x86", command_wait_s=0.5)
+        self.measurement_interval_ms = None
+        self.next_data_ready_ticks = None
+        self.single_shot = False
+
+    async def start_single_shot_schedule(self, interval_ms: int):
+        # Power cycled single shot mode, the sensor sleeps between readings.
+        # wait_for_data_ready wakes it up, read_single_shot powers it down.
+        self.single_shot = True
+        self.measurement_interval_ms = interval_ms
+        self.next_data_ready_ticks = utime.ticks_ms()
+        await self.power_down()
 
     async def measure_single_shot(self, rht_only: bool = False):
         command = b"\x21\x96" if rht_only else b"\x21\x9d"
@@ -36,15 +129,54 @@ class SCD41:
         )
 
     async def get_data_ready_status(self) -> bool:
-        # TODO: Use a bitmask here instead of comparing directly
+        response = await self._read_words(b"\xe4\xb8")
+        if response is None:
+            return False
         # if 11 lsb are 0, then data is not ready
-        return (
-            await _write_to_i2c(self.i2c_instance, b"\xe4\xb8", read_bytes=3)
-            != b"\x80\x00\xa2"
-        )
+        return bool(struct.unpack(">H", response[0:2])[0] & 0x07FF)
+
+    async def wait_for_data_ready(self):
+        # Sleeps until the periodic measurement is due and checks data ready
+        # once, falling back to short polls only if the reading is late.
+        # In single shot mode, sleeps until the next slot and wakes the sensor.
+        if self.next_data_ready_ticks is not None:
+            wait_ms = utime.ticks_diff(self.next_data_ready_ticks, utime.ticks_ms())
+            if wait_ms > 0:
+                debug_print("Sleeping for", wait_ms / 1000, "seconds")
+                await appropriate_async_sleep(wait_ms / 1000)
+
+        if self.single_shot:
+            # slots stay on a fixed cadence unless we've fallen a whole one behind
+            self.next_data_ready_ticks = utime.ticks_add(
+                self.next_data_ready_ticks, self.measurement_interval_ms
+            )
+            if utime.ticks_diff(self.next_data_ready_ticks, utime.ticks_ms()) <= 0:
+                self.next_data_ready_ticks = utime.ticks_add(
+                    utime.ticks_ms(), self.measurement_interval_ms
+                )
+            await self.wake_up()
+            return
+
+        late = False
+        while not await self.get_data_ready_status():
+            late = True
+            self.data_ready_misses += 1
+            await appropriate_async_sleep(DATA_READY_POLL_S)
+
+        if self.measurement_interval_ms is not None:
+            # On time, the schedule moves on by one interval so that delays
+            # on our side don't add up, a deadline that has passed is checked
+            # straight away. Late, it restarts from when the data turned up.
+            if late or self.next_data_ready_ticks is None:
+                self.next_data_ready_ticks = utime.ticks_ms()
+            self.next_data_ready_ticks = utime.ticks_add(
+                self.next_data_ready_ticks, self.measurement_interval_ms
+            )
 
     async def get_automatic_self_calibration_enabled(self) -> bool:
-        response = await _write_to_i2c(self.i2c_instance, b"\x23\x13", read_bytes=3)
+        response = await self._read_words(b"\x23\x13")
+        if response is None:
+            return None
         parsed_result = struct.unpack(">H", response[0:2])[0]
         return bool(parsed_result)
 
@@ -54,7 +186,9 @@ class SCD41:
         await _write_to_i2c(self.i2c_instance, b"\x24\x16" + parameters)
 
     async def get_sensor_altitude(self) -> int:
-        response = await _write_to_i2c(self.i2c_instance, b"\x23\x22", read_bytes=3)
+        response = await self._read_words(b"\x23\x22")
+        if response is None:
+            return None
         sensor_altitude_masl = struct.unpack(">H", response[0:2])[0]
         return sensor_altitude_masl
 
@@ -64,12 +198,16 @@ class SCD41:
         await _write_to_i2c(self.i2c_instance, b"\x24\x27" + parameters)
 
     async def get_temperature_offset_raw(self) -> float:
-        response = await _write_to_i2c(self.i2c_instance, b"\x23\x18", read_bytes=3)
+        response = await self._read_words(b"\x23\x18")
+        if response is None:
+            return None
         temp_offset = 175 * (struct.unpack(">H", response[0:2])[0] / 2**16)
         return temp_offset
 
     async def get_temperature_offset(self) -> float:
         raw_temp_offset = await self.get_temperature_offset_raw()
+        if raw_temp_offset is None:
+            return None
         return math.ceil(raw_temp_offset * 10) / 10
 
     async def set_temperature_offset(self, temperature_offset: float):
@@ -89,7 +227,9 @@ class SCD41:
         await _write_to_i2c(self.i2c_instance, b"\x36\x15", command_wait_s=0.8)
 
     async def perform_factory_reset(self):
-        await _write_to_i2c(self.i2c_instance, b"\x36\x32", command_wait_s=1.2)
+        await _write_to_i2c(
+            self.i2c_instance, b"\x36\x32", command_wait_s=1.2, retry_class="once"
+        )
 
     async def reinit(self):
         await _write_to_i2c(self.i2c_instance, b"\x36\x46", command_wait_s=0.02)
@@ -97,17 +237,22 @@ class SCD41:
     async def perform_forced_recalibration(self, reference_co2_ppm: int) -> tuple:
         parameters = struct.pack(">H", reference_co2_ppm)
         parameters += bytes([_calc_crc8(parameters)])
-        response = await _write_to_i2c(
-            self.i2c_instance,
+        # not retried, recalibration shouldn't be repeated
+        response = await self._read_words(
             b"\x36\x2f" + parameters,
-            read_bytes=3,
             command_wait_s=0.4,
+            retries=0,
+            retry_class="once",
         )
-        co2_drift = struct.unpack(">h", response[0:2]) - 0x8000
+        if response is None:
+            return (False, None)
+        co2_drift = struct.unpack(">H", response[0:2])[0] - 0x8000
         return ((co2_drift != 0x7FFF), co2_drift)
 
     async def get_serial_number(self) -> int:
-        sn_response = await _write_to_i2c(self.i2c_instance, b"\x36\x82", read_bytes=9)
+        sn_response = await self._read_words(b"\x36\x82", word_count=3)
+        if sn_response is None:
+            return None
         # this has to be a mess bc micropython does not support starargs properly
         # https://github.com/micropython/micropython/issues/1329
         sn = struct.unpack(
@@ -129,8 +274,8 @@ class SCD41:
 
     async def perform_self_test(self) -> bool:
         return (
-            await _write_to_i2c(
-                self.i2c_instance, b"\x36\x39", read_bytes=3, command_wait_s=10
+            await self._read_words(
+                b"\x36\x39", command_wait_s=10, retries=0, retry_class="once"
             )
             == b"\x00\x00\x81"
         )
@@ -138,15 +283,43 @@ class SCD41:
     async def power_down(self) -> bool:
         return await _write_to_i2c(self.i2c_instance, b"\x36\xe0")
 
-    async def wake_up(self) -> bool:
-        return await _write_to_i2c(self.i2c_instance, b"\x36\xf6", command_wait_s=0.02)
+    async def wake_up(self):
+        # The sensor doesn't acknowledge wake_up, see datasheet 3.10.3. This
+        # skips _write_to_i2c so the expected NACK isn't counted as an error.
+        try:
+            self.i2c_instance.writeto(0x62, b"\x36\xf6")
+        except OSError:
+            pass
+        await uasyncio.sleep(0.02)
+
+    async def read_single_shot(self, rht_only: bool = False) -> tuple:
+        # Takes a single shot reading on an awake sensor and powers it down.
+        # Returns the same as read_measurement, with co2 as None if rht_only.
+        if not rht_only:
+            # the first reading after waking up is to be discarded
+            await self.measure_single_shot()
+            await self.read_measurement()
+        await self.measure_single_shot(rht_only=rht_only)
+        measurement_status, co2, celsius, relative_humidity = (
+            await self.read_measurement()
+        )
+        await self.power_down()
+        return (
+            measurement_status,
+            None if rht_only else co2,
+            celsius,
+            relative_humidity,
+        )
 
     async def read_measurement(self) -> tuple:
-        measurement_data = await _write_to_i2c(
-            self.i2c_instance, b"\xec\x05", read_bytes=9
+        # reading the measurement empties the sensor's buffer, see
+        # _write_to_i2c
+        measurement_data = await self._read_words(
+            b"\xec\x05", word_count=3, retries=0, destructive_read=True
         )
         # If we failed to read the measurement data, return fake data
         if not measurement_data:
+            self.lost_measurements += 1
             return False, 0, 0, 0
 
         co2 = (measurement_data[0] << 8) + measurement_data[1]
@@ -156,7 +329,8 @@ class SCD41:
         relative_humidity = (
             100 * ((measurement_data[6] << 8) + measurement_data[7]) / ((2**16) - 1)
         )
-        debug_print(
-            "co2 ppm:", co2, "temp celsius:", celsius, "rh %:", relative_humidity
-        )
+        if DEBUG_LEVEL:
+            debug_print(
+                "co2 ppm:", co2, "temp celsius:", celsius, "rh %:", relative_humidity
+            )
         return True, co2, celsius, relative_humidity
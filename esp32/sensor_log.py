@@ -0,0 +1,495 @@
+from helpers import config, debug_print, DEBUG_LEVEL
+from scd41 import _calc_crc8
+import json
+import struct
+import utime
+
+# records are collected in RAM and written to flash in blocks of this size
+LOG_BLOCK_BYTES = config.get("log_block_bytes", 512)
+# a partly filled block is written once its oldest record is this old, so at
+# most this much logging is lost on a power cut
+LOG_MAX_LOSS_MS = int(config.get("log_max_loss_s", 600) * 1000)
+# size of each channel's preallocated ring file, 0 appends to plain log files
+LOG_RING_BYTES = config.get("log_ring_bytes", 0)
+# plain log files get a logs/<channel>.idx entry at most this often
+LOG_INDEX_INTERVAL_S = config.get("log_index_interval_s", 3600)
+# frames start out delta encoded, falling back to raw samples if that stops
+# paying off
+LOG_DELTA_ENCODING = config.get("log_delta_encoding", True)
+# one logs/combined.<log|ring> holding a record of all channels each cycle,
+# instead of a log per channel
+LOG_COMBINED = config.get("log_combined", False)
+
+# Log format v2 is a series of frames, each a header followed by samples
+# taken interval_s apart from its timestamp on. The header is the AN42 sync
+# marker, 0x80 | the data format id (v1 session headers have the plain id
+# there), flags, interval_s, timestamp, sample count and payload bytes,
+# then a CRC-8 of all that, so a sync marker in the data can't pass for one.
+# A frame written while still open has 0 samples and payload bytes, its
+# payload runs up to the next frame, its header is rewritten once it ends.
+FRAME_FORMAT = ">4sBBHIHH"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_FORMAT) + 1
+FRAME_FLAG_UNIX_TIME = 0x01
+FRAME_FLAG_SESSION_START = 0x02
+# The payload of a delta encoded frame is its first sample as is, then the
+# difference of each sample from the one before, as a zigzag varint: the
+# sign in the lowest bit, 7 bits a byte with the top bit set on all but the
+# last. Otherwise the payload is the raw samples.
+FRAME_FLAG_DELTA = 0x04
+
+# datapoint bytes by data format id, pressure needs 3
+DATA_SIZES = (2, 2, 2, 3)
+# Records of the combined log are a byte with bit <data format id> set for
+# each channel present, then those channels' datapoints in id order. A frame
+# only holds records of the same channels, so only its first record's
+# channel byte is kept when delta encoded, the deltas are per channel.
+COMBINED_FORMAT_ID = 4
+
+# utime.time() counts from 2000 on some ports, frames hold unix time
+_EPOCH_OFFSET_S = 946684800 if utime.gmtime(0)[0] == 2000 else 0
+# the RTC starts at its epoch until helpers.sync_clock sets it, earlier
+# timestamps only count time since then and aren't indexed
+_CLOCK_SET_AFTER_S = 1704067200
+
+# index entries: timestamp of a frame and its offset
+INDEX_FORMAT = ">II"
+
+# ring file header: magic, version, slot size, slot count, the index and
+# sequence number of the newest slot
+RING_MAGIC = b"AR42"
+RING_VERSION = 2
+RING_HEADER_FORMAT = ">4sBBHIII"
+RING_HEADER_SIZE = struct.calcsize(RING_HEADER_FORMAT)
+# slot header: sequence number (0 for never written), payload bytes used
+RING_SLOT_HEADER_FORMAT = ">IH"
+RING_SLOT_HEADER_SIZE = struct.calcsize(RING_SLOT_HEADER_FORMAT)
+
+# every BufferedLog, for flush_logs and log_stats_status
+open_logs = []
+# _delta_record's output, big enough for a combined record's deltas
+_delta_record = bytearray(24)
+_delta_record_view = memoryview(_delta_record)
+
+
+def log_time() -> int:
+    return utime.time() + _EPOCH_OFFSET_S
+
+
+def record_fields(format_id: int, first_byte: int) -> list:
+    # the sizes of the values a record is made of, delta encoded separately,
+    # after the channel byte of a combined record
+    if format_id != COMBINED_FORMAT_ID:
+        return [DATA_SIZES[format_id]]
+    fields = []
+    for data_format_id in range(len(DATA_SIZES)):
+        if first_byte & (1 << data_format_id):
+            fields.append(DATA_SIZES[data_format_id])
+    return fields
+
+
+class BufferedLog:
+    """Appends v2 frames to a log file, writing them in whole blocks."""
+
+    def __init__(
+        self,
+        name: str,
+        path: str,
+        block_bytes: int = LOG_BLOCK_BYTES,
+        index_path: str = None,
+    ):
+        self.name = name
+        self.block_bytes = block_bytes
+        self.file = self._open(path)
+        self.buffer = bytearray(self.block_bytes)
+        self.buffer_view = memoryview(self.buffer)
+        self.used = 0
+        # bytes of the buffer already written to the file
+        self.written = 0
+        self.oldest_ticks = 0
+        # see start_session
+        self.format_id = 0
+        self.interval_s = 0
+        self.session_start = False
+        # The frame being filled, it carries on across flushes. header_start
+        # is that of the frame open at the last flush, once that ends its
+        # header is rewritten in place.
+        self.frame_start = None
+        self.header_start = None
+        self.frame_time = 0
+        self.frame_samples = 0
+        self.frame_flags = 0
+        # for delta encoded frames, the size of each value in a record, their
+        # values in the last record and what the deltas have cost over raw
+        # samples lately
+        self.frame_fields = None
+        self.previous = [0] * len(DATA_SIZES)
+        self.frame_overhead = 0
+        # seek index, frames are indexed in _open_frame at most every
+        # LOG_INDEX_INTERVAL_S, and the entry written with them
+        self.index = None
+        if index_path:
+            # a new log file starts a new index
+            self.index = open(index_path, "ab" if self.block_offset else "wb")
+            self.index_pending = False
+            self.pending_time = self.pending_offset = 0
+            self.indexed_time = None
+        # for log_stats_status
+        self.records = 0
+        self.flushes = 0
+        self.bytes_written = 0
+        self.sample_bytes = 0
+        open_logs.append(self)
+
+    def _open(self, path: str):
+        # not "ab", the header of a frame that's still open is rewritten
+        try:
+            f = open(path, "r+b")
+        except OSError:
+            f = open(path, "w+b")
+        # the file offset of the start of the buffer
+        self.block_offset = f.seek(0, 2)
+        return f
+
+    def start_session(self, format_id: int, interval_s: int):
+        if self.frame_start is not None:
+            self._close_frame()
+        self.format_id = format_id
+        self.interval_s = interval_s
+        self.session_start = True
+
+    def write(self, datapoint: bytes):
+        now = log_time()
+        record = datapoint
+        delta = LOG_DELTA_ENCODING
+        if self.frame_start is not None:
+            if (
+                abs(now - self.frame_time - self.frame_samples * self.interval_s) * 2
+                > self.interval_s
+                or self.format_id == COMBINED_FORMAT_ID
+                and datapoint[0] != self.buffer[self.frame_start + FRAME_HEADER_SIZE]
+            ):
+                # a missed or late reading, the next frame restarts the timing.
+                # Or a change in which channels a combined record has.
+                self._close_frame()
+            elif self.frame_flags & FRAME_FLAG_DELTA:
+                record = self._delta_record(datapoint)
+                self.frame_overhead = max(
+                    0, self.frame_overhead + len(record) - len(datapoint)
+                )
+                if self.frame_overhead > FRAME_HEADER_SIZE:
+                    # large deltas, a raw frame is cheaper from here on
+                    self._close_frame()
+                    delta = False
+        if self.frame_start is not None and self.used + len(record) > len(self.buffer):
+            self._close_frame()
+        if self.frame_start is None:
+            record = datapoint
+            if self.used + FRAME_HEADER_SIZE + len(datapoint) > len(self.buffer):
+                self._end_block()
+            self._open_frame(now, datapoint, delta)
+        if self.used == self.written:
+            self.oldest_ticks = utime.ticks_ms()
+        self.buffer_view[self.used : self.used + len(record)] = record
+        self.used += len(record)
+        self.frame_samples += 1
+        self.sample_bytes += len(datapoint)
+        # a full block is ended by the next record, flush_if_due writes it
+        # before then if need be
+        self.records += 1
+
+    def _open_frame(self, now: int, datapoint: bytes, delta: bool):
+        clock_set = now >= _CLOCK_SET_AFTER_S
+        if (
+            self.index
+            and clock_set
+            and not self.index_pending
+            and (
+                self.indexed_time is None
+                or now - self.indexed_time >= LOG_INDEX_INTERVAL_S
+            )
+        ):
+            self.index_pending = True
+            self.pending_time = now
+            self.pending_offset = self.block_offset + self.used
+        self.frame_start = self.used
+        self.used += FRAME_HEADER_SIZE
+        self.frame_time = now
+        self.frame_samples = 0
+        self.frame_flags = FRAME_FLAG_UNIX_TIME if clock_set else 0
+        if self.session_start:
+            self.frame_flags |= FRAME_FLAG_SESSION_START
+            self.session_start = False
+        if delta:
+            # the first record is stored as it is, the base for the deltas
+            self.frame_flags |= FRAME_FLAG_DELTA
+            self.frame_fields = record_fields(self.format_id, datapoint[0])
+            self.frame_overhead = 0
+            self._delta_record(datapoint)
+
+    def _delta_record(self, datapoint: bytes) -> memoryview:
+        # the zigzag varint deltas of the values in datapoint from the last
+        # record's, which it then replaces
+        encoded = _delta_record
+        encoded_bytes = 0
+        position = 1 if self.format_id == COMBINED_FORMAT_ID else 0
+        previous = self.previous
+        for field, size in enumerate(self.frame_fields):
+            value = 0
+            for offset in range(size):
+                value = (value << 8) | datapoint[position + offset]
+            position += size
+            delta = value - previous[field]
+            previous[field] = value
+            delta = delta << 1 if delta >= 0 else (-delta << 1) - 1
+            while delta >= 0x80:
+                encoded[encoded_bytes] = 0x80 | (delta & 0x7F)
+                encoded_bytes += 1
+                delta >>= 7
+            encoded[encoded_bytes] = delta
+            encoded_bytes += 1
+        return _delta_record_view[:encoded_bytes]
+
+    def _close_frame(self):
+        self._pack_header(
+            self.frame_samples, self.used - self.frame_start - FRAME_HEADER_SIZE
+        )
+        self.frame_start = None
+
+    def _pack_header(self, samples: int, payload_bytes: int):
+        header_end = self.frame_start + FRAME_HEADER_SIZE - 1
+        self.buffer[self.frame_start : header_end] = struct.pack(
+            FRAME_FORMAT,
+            b"AN42",
+            0x80 | self.format_id,
+            self.frame_flags,
+            self.interval_s,
+            self.frame_time,
+            samples,
+            payload_bytes,
+        )
+        self.buffer[header_end] = _calc_crc8(
+            self.buffer_view[self.frame_start : header_end]
+        )
+
+    def _end_block(self):
+        if self.frame_start is not None:
+            self._close_frame()
+        self.flush()
+        self.block_offset += self.used
+        self.used = self.written = 0
+        self.header_start = None
+
+    def flush_if_due(self):
+        if (
+            self.used > self.written
+            and utime.ticks_diff(utime.ticks_ms(), self.oldest_ticks) >= LOG_MAX_LOSS_MS
+        ):
+            self.flush()
+
+    def flush(self):
+        if self.frame_start is not None and self.frame_start >= self.written:
+            self._pack_header(0, 0)
+        if self.used > self.written or self.header_start != self.frame_start:
+            self._write_pending()
+            self.written = self.used
+            self.header_start = self.frame_start
+
+    def _write_pending(self):
+        if self.header_start is not None and self.header_start != self.frame_start:
+            # the frame open at the last flush has ended
+            self.file.seek(self.block_offset + self.header_start)
+            self.file.write(
+                self.buffer_view[
+                    self.header_start : self.header_start + FRAME_HEADER_SIZE
+                ]
+            )
+            self.bytes_written += FRAME_HEADER_SIZE
+        self.file.seek(self.block_offset + self.written)
+        self._write_to_file(self.buffer_view[self.written : self.used])
+        if self.index_pending:
+            self.index.write(
+                struct.pack(INDEX_FORMAT, self.pending_time, self.pending_offset)
+            )
+            self.index.flush()
+            self.indexed_time = self.pending_time
+            self.index_pending = False
+
+    def _write_to_file(self, data):
+        self.file.write(data)
+        self.file.flush()
+        self.flushes += 1
+        self.bytes_written += len(data)
+        if DEBUG_LEVEL:
+            debug_print("Wrote", len(data), "bytes to the", self.name, "log")
+
+
+class RingLog(BufferedLog):
+    """A preallocated log file of slots, each block_bytes with its header.
+    The block being filled is rewritten in its slot on every flush, once
+    full the next slot is started, overwriting the oldest."""
+
+    def __init__(
+        self,
+        name: str,
+        path: str,
+        ring_bytes: int = LOG_RING_BYTES,
+        block_bytes: int = LOG_BLOCK_BYTES,
+    ):
+        self.ring_bytes = ring_bytes
+        # slots are written whole, from their offset
+        self.block_offset = 0
+        super().__init__(name, path, block_bytes - RING_SLOT_HEADER_SIZE)
+        self._start_slot()
+
+    def _open(self, path: str):
+        try:
+            f = open(path, "r+b")
+            magic, version, _, slot_bytes, slot_count, head, sequence = struct.unpack(
+                RING_HEADER_FORMAT, f.read(RING_HEADER_SIZE)
+            )
+            if magic == RING_MAGIC and version == RING_VERSION and head < slot_count:
+                # keeps the existing layout, delete the file to resize it
+                self.block_bytes = slot_bytes - RING_SLOT_HEADER_SIZE
+                self.slot_count = slot_count
+                self.head = head
+                self.sequence = sequence
+                return f
+            f.close()
+        except (OSError, ValueError):
+            pass
+
+        # preallocated up front, so the filesystem can't fill up later
+        f = open(path, "w+b")
+        # the file header counts towards ring_bytes, at least one slot
+        # however small it is
+        self.slot_count = max(
+            1, (self.ring_bytes - RING_HEADER_SIZE) // self.slot_bytes
+        )
+        self.head = self.sequence = 0
+        f.write(self._ring_header())
+        empty_slot = bytes(self.slot_bytes)
+        for slot in range(self.slot_count):
+            try:
+                f.write(empty_slot)
+                f.flush()
+            except OSError as e:
+                if not slot:
+                    raise
+                debug_print("Only had space for", slot, self.name, "log slots:", e)
+                self.slot_count = slot
+                f.seek(0)
+                f.write(self._ring_header())
+                break
+        return f
+
+    def _ring_header(self) -> bytes:
+        return struct.pack(
+            RING_HEADER_FORMAT,
+            RING_MAGIC,
+            RING_VERSION,
+            0,
+            self.slot_bytes,
+            self.slot_count,
+            self.head,
+            self.sequence,
+        )
+
+    @property
+    def slot_bytes(self) -> int:
+        return self.block_bytes + RING_SLOT_HEADER_SIZE
+
+    def _slot_offset(self, slot: int) -> int:
+        return RING_HEADER_SIZE + slot * self.slot_bytes
+
+    def _start_slot(self):
+        # continues after the newest slot, every boot starts a new one
+        if self.sequence:
+            self.head = (self.head + 1) % self.slot_count
+        self.sequence += 1
+        self.file.seek(0)
+        self.file.write(self._ring_header())
+
+    def _end_block(self):
+        super()._end_block()
+        self._start_slot()
+
+    def _write_pending(self):
+        # slots start with a frame, so they can be found by time without
+        # an index
+        self.file.seek(self._slot_offset(self.head))
+        self.file.write(struct.pack(RING_SLOT_HEADER_FORMAT, self.sequence, self.used))
+        self.bytes_written += RING_SLOT_HEADER_SIZE
+        # the block so far, never more than block_bytes however full the ring is
+        self._write_to_file(self.buffer_view[: self.used])
+
+
+class CombinedLog:
+    """Joins the datapoints of each cycle into one record of a combined log,
+    see COMBINED_FORMAT_ID. channel() stands in for a channel's own log."""
+
+    def __init__(self, log: BufferedLog, interval_s: int):
+        self.log = log
+        self.datapoints = [None] * len(DATA_SIZES)
+        self.record = bytearray(1 + sum(DATA_SIZES))
+        self.record_view = memoryview(self.record)
+        log.start_session(COMBINED_FORMAT_ID, interval_s)
+
+    def channel(self, format_id: int) -> "CombinedChannel":
+        return CombinedChannel(self, format_id)
+
+    def end_record(self):
+        # called every cycle, a cycle without any datapoints leaves a gap
+        used = 1
+        self.record[0] = 0
+        for format_id, datapoint in enumerate(self.datapoints):
+            if datapoint is not None:
+                self.record[0] |= 1 << format_id
+                self.record[used : used + len(datapoint)] = datapoint
+                used += len(datapoint)
+                self.datapoints[format_id] = None
+        if self.record[0]:
+            self.log.write(self.record_view[:used])
+
+
+class CombinedChannel:
+    def __init__(self, combined: CombinedLog, format_id: int):
+        self.combined = combined
+        self.format_id = format_id
+
+    def write(self, datapoint: bytes):
+        self.combined.datapoints[self.format_id] = datapoint
+
+
+def open_log(name: str) -> BufferedLog:
+    if LOG_RING_BYTES:
+        return RingLog(name, f"logs/{name}.ring")
+    return BufferedLog(name, f"logs/{name}.log", index_path=f"logs/{name}.idx")
+
+
+def flush_due_logs():
+    # called every cycle, writes blocks that have waited LOG_MAX_LOSS_MS
+    for log in open_logs:
+        log.flush_if_due()
+
+
+def flush_logs():
+    # before resets, or anything else that would lose the buffers
+    for log in open_logs:
+        log.flush()
+
+
+def log_stats_status() -> dict:
+    # flat log_<name>_<counter> keys for the web server's status
+    status = {}
+    for log in open_logs:
+        prefix = "log_" + log.name + "_"
+        status[prefix + "records"] = log.records
+        status[prefix + "flushes"] = log.flushes
+        status[prefix + "bytes_written"] = log.bytes_written
+        status[prefix + "sample_bytes"] = log.sample_bytes
+        status[prefix + "buffered_bytes"] = log.used - log.written
+    return status
+
+
+def log_stats_json() -> bytes:
+    return json.dumps(log_stats_status()).encode()
@@ -2,11 +2,14 @@ from machine import SPI, SoftSPI, Pin
 import machine
 import gc
 import time
+import struct
+import uasyncio
 import comic_code_24
 import comic_code_48
 from helpers import (
     debug_print,
     config,
+    DEBUG_LEVEL,
     wlan_enabled,
     bt_enabled,
     set_cpu_freq_by_config,
@@ -15,6 +18,10 @@ from helpers import (
 CS_PIN = Pin(config["pins"]["screen_cs"], mode=Pin.OUT, value=1)
 BUSY_PIN = Pin(config["pins"]["screen_busy"], mode=Pin.IN)
 DC_PIN = Pin(config["pins"]["screen_dc"], mode=Pin.OUT)
+# set from the BUSY pin IRQ, see wait_until_idle_async
+busy_flag = None
+# LUT file contents, see load_lut
+luts = {}
 
 EPD_WIDTH = config["screen"]["width"]
 EPD_HEIGHT = config["screen"]["height"]
@@ -36,10 +43,54 @@ else:
 
 
 LINE_WIDTH = int(EPD_WIDTH / 8) if (EPD_WIDTH % 8 == 0) else int(EPD_WIDTH / 8 + 1)
+# a whole frame by default, lower this to split the push into row chunks
+SPI_CHUNK_SIZE = config["spi"].get("chunk_size", LINE_WIDTH * EPD_HEIGHT)
 
+# frame push timing, in ms
+last_push_ms = 0
+total_push_ms = 0
+push_count = 0
+
+# partial refresh, see display
+PARTIAL_REFRESH = config["screen"].get("partial_refresh", False)
+FULL_REFRESH_EVERY = config["screen"].get("full_refresh_every", 10)
+in_partial_mode = False
+partial_updates = 0
+
+
+FBUF_SIZE = LINE_WIDTH * EPD_HEIGHT
+FBUF_COLUMNS = LINE_WIDTH * 8
 
 gc.collect()
-fbuf = [0xFF] * int(LINE_WIDTH * EPD_HEIGHT)
+# 1 bit per pixel, a cleared bit is black
+fbuf = bytearray(b"\xff" * FBUF_SIZE)
+fbuf_view = memoryview(fbuf)
+# what's currently on the panel, only kept for partial refresh
+last_frame = bytearray(FBUF_SIZE) if PARTIAL_REFRESH else None
+
+# decoded glyphs, see get_glyph
+GLYPH_CACHE_BUDGET = config["screen"].get("glyph_cache_bytes", 6144)
+glyph_cache = {}
+glyph_cache_order = []
+glyph_cache_bytes = 0
+glyph_cache_hits = 0
+glyph_cache_misses = 0
+
+# glyph table font format, see tools/helper_convertfont.py
+FONT_MAGIC = b"A42F"
+FONT_HEADER_FORMAT = "<4sBBBBHH"
+FONT_HEADER_SIZE = struct.calcsize(FONT_HEADER_FORMAT)
+# per font file: (rotation, scale, bit_width, row_count, offset table),
+# or None for the legacy format
+font_headers = {}
+
+# static part of the main screen, see load_display_template
+template_fbuf = None
+template_key = None
+
+# what draw_display last put on screen, identical frames aren't redrawn
+last_display_fields = None
+skipped_refreshes = 0
 
 
 def wait_until_idle():
@@ -47,6 +98,25 @@ def wait_until_idle():
         time.sleep(0.1)
 
 
+async def wait_until_idle_async():
+    # Woken by the falling edge of BUSY where ThreadSafeFlag is available,
+    # with a poll every 100ms in case an edge is missed.
+    global busy_flag
+
+    if busy_flag is None and hasattr(uasyncio, "ThreadSafeFlag"):
+        busy_flag = uasyncio.ThreadSafeFlag()
+        BUSY_PIN.irq(trigger=Pin.IRQ_FALLING, handler=lambda _: busy_flag.set())
+
+    while BUSY_PIN.value() != 0:
+        if busy_flag is None:
+            await uasyncio.sleep_ms(100)
+            continue
+        try:
+            await uasyncio.wait_for_ms(busy_flag.wait(), 100)
+        except uasyncio.TimeoutError:
+            pass
+
+
 def spi_transfer(data: bytes):
     CS_PIN(0)
     spi.write(data)
@@ -63,32 +133,256 @@ def send_data(data: int):
     spi_transfer(bytes([data]))
 
 
-def display(frame_buf):
-    send_command(0x24)
-    for h in range(EPD_HEIGHT):
-        for w in range(LINE_WIDTH):
-            data = frame_buf[w + h * LINE_WIDTH]
-            send_data(data)
+def send_data_buffer(data):
+    # DC and CS stay asserted for the whole buffer, which is then streamed in
+    # as few spi.write calls as possible without copying it.
+    data = memoryview(data)
+    DC_PIN(1)
+    CS_PIN(0)
+    for offset in range(0, len(data), SPI_CHUNK_SIZE):
+        spi.write(data[offset : offset + SPI_CHUNK_SIZE])
+    CS_PIN(1)
+
 
+def _push_frame(frame_buf, command=0x24):
+    global last_push_ms, total_push_ms, push_count
+
+    push_start_ms = time.ticks_ms()
+    send_command(command)
+    send_data_buffer(frame_buf)
+    last_push_ms = time.ticks_diff(time.ticks_ms(), push_start_ms)
+    total_push_ms += last_push_ms
+    push_count += 1
+    debug_print("Frame pushed in", last_push_ms, "ms")
+
+
+def _start_refresh(update_control=0xC7):
     # DISPLAY REFRESH
     send_command(0x22)
-    send_data(0xC7)
+    send_data(update_control)
     send_command(0x20)
+
+
+def _refresh(update_control=0xC7):
+    _start_refresh(update_control)
     wait_until_idle()
+
+
+def _needs_full_update():
+    # after FULL_REFRESH_EVERY partial updates the full waveform is reloaded
+    # to clear out ghosting
+    return in_partial_mode and partial_updates >= FULL_REFRESH_EVERY
+
+
+def _start_display(frame_buf):
+    # Pushes the frame and starts the refresh without waiting for it.
+    # Returns the refresh's update control, or None if nothing was started.
+    global partial_updates
+
+    if in_partial_mode:
+        window = _dirty_window(frame_buf)
+        if window is None:
+            debug_print("Display unchanged, not refreshing")
+            return None
+        _display_window(frame_buf, *window)
+        partial_updates += 1
+        _start_refresh(0x0C)
+        debug_print("Display partially updating:", window)
+        return 0x0C
+
+    _push_frame(frame_buf)
+    if PARTIAL_REFRESH:
+        # partial updates need the base image in both RAMs
+        _push_frame(frame_buf, command=0x26)
+        last_frame[:] = frame_buf
+    _start_refresh(0xC7)
+    return 0xC7
+
+
+def _finish_display(update_control):
+    # Called once the panel is idle again after _start_display. Returns
+    # whether partial mode has to be set up again.
+    global partial_updates
+
     debug_print("Display updated")
+    if PARTIAL_REFRESH and update_control == 0xC7:
+        partial_updates = 0
+        return True
+    return False
 
 
-def send_lut_full_update_data(file_handle, byte_count):
-    file_handle.seek(byte_count)
-    send_data(file_handle.read(1)[0])
+def display(frame_buf):
+    if _needs_full_update():
+        init_display()
+    update_control = _start_display(frame_buf)
+    if update_control is not None:
+        wait_until_idle()
+        if _finish_display(update_control):
+            init_partial_mode()
+
+
+async def display_async(frame_buf):
+    # same as display, but yields to other tasks whenever the panel is busy
+    if _needs_full_update():
+        await init_display_async()
+    update_control = _start_display(frame_buf)
+    if update_control is not None:
+        await wait_until_idle_async()
+        if _finish_display(update_control):
+            await init_partial_mode_async()
+
+
+def _dirty_window(frame_buf):
+    # Returns the (first_row, last_row, first_byte, last_byte) window that
+    # differs from the frame on the panel, or None if nothing does.
+    first_row = last_row = None
+    first_byte = LINE_WIDTH
+    last_byte = -1
+    for row in range(EPD_HEIGHT):
+        base = row * LINE_WIDTH
+        if frame_buf[base : base + LINE_WIDTH] == last_frame[base : base + LINE_WIDTH]:
+            continue
+        if first_row is None:
+            first_row = row
+        last_row = row
+        for byte_index in range(LINE_WIDTH):
+            if frame_buf[base + byte_index] != last_frame[base + byte_index]:
+                first_byte = min(first_byte, byte_index)
+                last_byte = max(last_byte, byte_index)
+
+    if first_row is None:
+        return None
+    return first_row, last_row, first_byte, last_byte
+
+
+def _set_ram_window(first_row, last_row, first_byte, last_byte):
+    # Y is counted down from the last RAM row, see data entry mode in
+    # init_display
+    first_y = EPD_HEIGHT - 1 - first_row
+    last_y = EPD_HEIGHT - 1 - last_row
 
+    send_command(0x44)  # set Ram-X address start/end position
+    send_data(first_byte)
+    send_data(last_byte)
 
-def init_display():
-    lut_full_update_file = open("waveshare_lut_full_update.bin", "rb")
+    send_command(0x45)  # set Ram-Y address start/end position
+    send_data(first_y & 0xFF)
+    send_data(first_y >> 8)
+    send_data(last_y & 0xFF)
+    send_data(last_y >> 8)
+
+    send_command(0x4E)  # set RAM x address count
+    send_data(first_byte)
+    send_command(0x4F)  # set RAM y address count
+    send_data(first_y & 0xFF)
+    send_data(first_y >> 8)
+
+
+def _send_window(frame_buf, first_row, last_row, first_byte, last_byte, invert):
+    frame_view = memoryview(frame_buf)
+    window_width = last_byte - first_byte + 1
+    inverted_row = bytearray(window_width) if invert else None
+    DC_PIN(1)
+    CS_PIN(0)
+    for row in range(first_row, last_row + 1):
+        base = row * LINE_WIDTH + first_byte
+        if invert:
+            for byte_index in range(window_width):
+                inverted_row[byte_index] = 0xFF ^ frame_buf[base + byte_index]
+            spi.write(inverted_row)
+        else:
+            spi.write(frame_view[base : base + window_width])
+    CS_PIN(1)
+
+
+def _display_window(frame_buf, first_row, last_row, first_byte, last_byte):
+    global last_push_ms, total_push_ms, push_count
+
+    push_start_ms = time.ticks_ms()
+    _set_ram_window(first_row, last_row, first_byte, last_byte)
+    send_command(0x24)
+    _send_window(frame_buf, first_row, last_row, first_byte, last_byte, False)
+    _set_ram_window(first_row, last_row, first_byte, last_byte)
+    send_command(0x26)
+    _send_window(frame_buf, first_row, last_row, first_byte, last_byte, True)
+    last_push_ms = time.ticks_diff(time.ticks_ms(), push_start_ms)
+    total_push_ms += last_push_ms
+    push_count += 1
+    debug_print("Window pushed in", last_push_ms, "ms")
+
+    for row in range(first_row, last_row + 1):
+        base = row * LINE_WIDTH
+        last_frame[base + first_byte : base + last_byte + 1] = frame_buf[
+            base + first_byte : base + last_byte + 1
+        ]
+
+
+def load_lut(filename):
+    # LUT files are read once and kept, they're only 76 bytes each
+    if filename not in luts:
+        with open(filename, "rb") as lut_file:
+            luts[filename] = lut_file.read()
+    return luts[filename]
+
+
+def send_lut(lut, waveform_only=False):
+    # LUT files hold the 70 byte waveform followed by the gate voltage, the
+    # source voltages, the dummy line and the gate time
+    lut = memoryview(lut)
+    if not waveform_only:
+        send_command(0x03)  # Gate voltage
+        send_data_buffer(lut[70:71])
+        send_command(0x04)  # Source voltage
+        send_data_buffer(lut[71:74])
+        send_command(0x3A)  # Dummy Line
+        send_data_buffer(lut[74:75])
+        send_command(0x3B)  # Gate time
+        send_data_buffer(lut[75:76])
+
+    send_command(0x32)
+    send_data_buffer(lut[:70])
+
+
+def _set_partial_waveform():
+    send_lut(load_lut("waveshare_lut_partial_update.bin"), waveform_only=True)
+
+    send_command(0x37)  # display option, enables RAM ping-pong
+    for option_byte in (0x00, 0x00, 0x00, 0x00, 0x40, 0x00, 0x00, 0x00, 0x00, 0x00):
+        send_data(option_byte)
+
+    _start_refresh(0xC0)  # enable clock and analog
+
+
+def _partial_mode_ready():
+    global in_partial_mode
+
+    send_command(0x3C)  # BorderWavefrom
+    send_data(0x01)
+    in_partial_mode = True
+    debug_print("Display partial mode initialized")
+
+
+def init_partial_mode():
+    # based on waveshare's epd2in13_V2 partial update init
+    send_command(0x2C)  # VCOM Voltage
+    send_data(0x26)
     wait_until_idle()
-    send_command(0x12)  # soft reset
+    _set_partial_waveform()
     wait_until_idle()
+    _partial_mode_ready()
+
+
+async def init_partial_mode_async():
+    send_command(0x2C)  # VCOM Voltage
+    send_data(0x26)
+    await wait_until_idle_async()
+    _set_partial_waveform()
+    await wait_until_idle_async()
+    _partial_mode_ready()
+
 
+def _configure_display():
+    # everything init_display sends after the soft reset
     send_command(0x74)  # set analog block control
     send_data(0x54)
     send_command(0x7E)  # set digital block control
@@ -118,64 +412,290 @@ def init_display():
     send_command(0x2C)  # VCOM Voltage
     send_data(0x55)
 
-    send_command(0x03)
-    send_lut_full_update_data(lut_full_update_file, 70)
-
-    send_command(0x04)
-    send_lut_full_update_data(lut_full_update_file, 71)
-    send_lut_full_update_data(lut_full_update_file, 72)
-    send_lut_full_update_data(lut_full_update_file, 73)
-
-    send_command(0x3A)  # Dummy Line
-    send_lut_full_update_data(lut_full_update_file, 74)
-    send_command(0x3B)  # Gate time
-    send_lut_full_update_data(lut_full_update_file, 75)
-
-    send_command(0x32)
-    for i in range(70):
-        send_lut_full_update_data(lut_full_update_file, i)
+    send_lut(load_lut("waveshare_lut_full_update.bin"))
 
     send_command(0x4E)  # set RAM x address count to 0
     send_data(0x00)
     send_command(0x4F)  # set RAM y address count to 0X127
     send_data(0xF9)
     send_data(0x00)
+
+
+def init_display():
+    global in_partial_mode
+
     wait_until_idle()
-    lut_full_update_file.close()
+    send_command(0x12)  # soft reset
+    wait_until_idle()
+    _configure_display()
+    wait_until_idle()
+    in_partial_mode = False
     debug_print("Display initialized")
 
 
-def fbuf_pixel(x, y, color=1):
-    global fbuf
-    newx = EPD_WIDTH - (x - 1)
+async def init_display_async():
+    global in_partial_mode
+
+    await wait_until_idle_async()
+    send_command(0x12)  # soft reset
+    await wait_until_idle_async()
+    _configure_display()
+    await wait_until_idle_async()
+    in_partial_mode = False
+    debug_print("Display initialized")
+
+
+def _fill_bytes(start, end, value):
+    # fill fbuf[start:end] with value by doubling up what's already been filled
+    if end <= start:
+        return
+    fbuf[start] = value
+    filled = 1
+    total = end - start
+    while filled < total:
+        chunk = min(filled, total - filled)
+        fbuf_view[start + filled : start + filled + chunk] = fbuf_view[
+            start : start + chunk
+        ]
+        filled += chunk
+
+
+def _mask_byte(index, mask, color=1):
     if color == 1:
-        fbuf[int(newx / 8) + y * LINE_WIDTH] &= ~(0x80 >> (newx % 8))
+        fbuf[index] &= 0xFF ^ mask
     else:
-        fbuf[int(newx / 8) + y * LINE_WIDTH] |= 0x80 >> (newx % 8)
+        fbuf[index] |= mask
 
 
-def fbuf_horizontal_line(xoff, yoff, width, color=1):
-    global fbuf
-    full_color = 0x00 if color else 0xFF
+def fbuf_fill(col_start, row_start, col_end, row_end, color=1):
+    # fills buffer columns [col_start, col_end) of rows [row_start, row_end)
+    # note: buffer columns run opposite to screen x, see fbuf_pixel
+    col_start = max(col_start, 0)
+    col_end = min(col_end, FBUF_COLUMNS)
+    row_start = max(row_start, 0)
+    row_end = min(row_end, EPD_HEIGHT)
+    if col_start >= col_end or row_start >= row_end:
+        return
+
+    # bytes that are fully covered, the partial ones on the edges get masked
+    full_start = (col_start + 7) >> 3
+    full_end = col_end >> 3
+    edges = []
+    if full_start > full_end:
+        edges.append(
+            (full_end, (0xFF >> (col_start & 7)) & (0xFF << (8 - (col_end & 7))))
+        )
+    else:
+        if col_start & 7:
+            edges.append((full_start - 1, 0xFF >> (col_start & 7)))
+        if col_end & 7:
+            edges.append((full_end, (0xFF << (8 - (col_end & 7))) & 0xFF))
+
+    first_row = row_start * LINE_WIDTH
+    if full_start < full_end:
+        _fill_bytes(
+            first_row + full_start, first_row + full_end, 0x00 if color else 0xFF
+        )
+    for row in range(row_start, row_end):
+        base = row * LINE_WIDTH
+        if base != first_row and full_start < full_end:
+            fbuf_view[base + full_start : base + full_end] = fbuf_view[
+                first_row + full_start : first_row + full_end
+            ]
+        for byte_index, mask in edges:
+            _mask_byte(base + byte_index, mask, color)
+
+
+def fbuf_blit(data, row_bytes, col, row, color=1):
+    # ORs MSB-first bit rows, row_bytes each, into the buffer starting at
+    # buffer column col, set bits are drawn in color and unset bits are left
+    # untouched
+    shift = col & 7
+    first_byte = col >> 3
+    for src_index in range(0, len(data), row_bytes):
+        if 0 <= row < EPD_HEIGHT:
+            base = row * LINE_WIDTH
+            byte_index = first_byte
+            for src_byte in data[src_index : src_index + row_bytes]:
+                if src_byte:
+                    if 0 <= byte_index < LINE_WIDTH:
+                        _mask_byte(base + byte_index, src_byte >> shift, color)
+                    if shift and 0 <= byte_index + 1 < LINE_WIDTH:
+                        _mask_byte(
+                            base + byte_index + 1,
+                            (src_byte << (8 - shift)) & 0xFF,
+                            color,
+                        )
+                byte_index += 1
+        row += 1
+
 
-    # first pixels before 8-blocks
-    for x in range(8 - (xoff % 8)):
-        fbuf_pixel(xoff + x, yoff, color)
+def fbuf_pixel(x, y, color=1):
+    newx = EPD_WIDTH - (x - 1)
+    _mask_byte((newx >> 3) + y * LINE_WIDTH, 0x80 >> (newx & 7), color)
 
-    # the in-between 8-blocks
-    for x in range(width // 8):
-        newx = EPD_WIDTH - (xoff + (xoff % 8) + (x * 8))
-        fbuf[(newx // 8) + yoff * LINE_WIDTH] = full_color
 
-    # last pixels after 8-blocks
-    for x in range((width % 8) + 1):
-        fbuf_pixel(xoff + (width - x), yoff, color)
+def fbuf_horizontal_line(xoff, yoff, width, color=1):
+    fbuf_rect(xoff, yoff, width, 1, color)
 
 
 def fbuf_rect(xoff, yoff, width, height, color=1):
-    for y in range(height):
-        fbuf_horizontal_line(xoff, y + yoff, width, color)
-    gc.collect()
+    # screen x of [xoff, xoff + width) maps to buffer columns in reverse
+    col_end = EPD_WIDTH + 2 - xoff
+    fbuf_fill(col_end - width, yoff, col_end, yoff + height, color)
+
+
+def _decode_glyph(font, font_file, char_index, rot=0):
+    # Returns the glyph as MSB-first bit rows in buffer order, with set bits
+    # for ink, plus the width of a row in bits.
+    # Legacy font files hold all glyphs interleaved row by row, LSB-first.
+    char_width = font.width // 8
+    raw = bytearray(char_width * font.height)
+    raw_view = memoryview(raw)
+    for y in range(font.height):
+        font_file.seek(char_width * char_index + (len(font.chars) * char_width * y))
+        font_file.readinto(raw_view[y * char_width : (y + 1) * char_width])
+
+    if rot == 1:
+        # one buffer row per glyph column, glyph rows run along the buffer row
+        row_bytes = (font.height + 7) >> 3
+        glyph = bytearray(row_bytes * font.width)
+        for x in range(font.width):
+            for y in range(font.height):
+                if not (raw[y * char_width + (x >> 3)] >> (x & 7)) & 1:
+                    glyph[x * row_bytes + (y >> 3)] |= 0x80 >> (y & 7)
+        return glyph, font.height
+
+    # buffer columns are mirrored, which makes a LSB-first glyph row MSB-first
+    # once its bytes are reversed
+    for y in range(font.height):
+        row = raw_view[y * char_width : (y + 1) * char_width]
+        for x in range(char_width // 2):
+            row[x], row[char_width - 1 - x] = row[char_width - 1 - x], row[x]
+        for x in range(char_width):
+            row[x] ^= 0xFF
+    return raw, font.width
+
+
+def _read_font_header(font, font_file):
+    if font.bin_filename not in font_headers:
+        font_file.seek(0)
+        header = font_file.read(FONT_HEADER_SIZE)
+        if header[:4] != FONT_MAGIC:
+            font_headers[font.bin_filename] = None
+        else:
+            _, _, rotation, scale, glyph_count, bit_width, row_count = struct.unpack(
+                FONT_HEADER_FORMAT, header
+            )
+            font_headers[font.bin_filename] = (
+                rotation,
+                scale,
+                bit_width,
+                row_count,
+                font_file.read(4 * glyph_count),
+            )
+    return font_headers[font.bin_filename]
+
+
+def _read_table_glyph(font_file, header, char_index):
+    # glyphs in the table format are stored ready to blit, one read each
+    _, _, bit_width, row_count, offset_table = header
+    glyph = bytearray(((bit_width + 7) >> 3) * row_count)
+    font_file.seek(struct.unpack_from("<I", offset_table, 4 * char_index)[0])
+    font_file.readinto(glyph)
+    return glyph, bit_width
+
+
+def _rotate_glyph(glyph, bit_width, rot):
+    # Swaps a glyph between the rot=0 and rot=1 buffer layouts.
+    # rot=0 row y bit (width - 1 - x) and rot=1 row x bit y are the same pixel.
+    row_bytes = (bit_width + 7) >> 3
+    row_count = len(glyph) // row_bytes
+    rotated_row_bytes = (row_count + 7) >> 3
+    rotated = bytearray(rotated_row_bytes * bit_width)
+    for src_row in range(row_count):
+        for src_bit in range(bit_width):
+            if glyph[src_row * row_bytes + (src_bit >> 3)] & (0x80 >> (src_bit & 7)):
+                if rot == 1:
+                    dst_row = bit_width - 1 - src_bit
+                    dst_bit = src_row
+                else:
+                    dst_row = src_bit
+                    dst_bit = row_count - 1 - src_row
+                rotated[dst_row * rotated_row_bytes + (dst_bit >> 3)] |= 0x80 >> (
+                    dst_bit & 7
+                )
+    return rotated, row_count
+
+
+def _load_glyph(font, font_file, char_index, rot=0, scale=1):
+    header = _read_font_header(font, font_file)
+    if header is None:
+        glyph, bit_width = _decode_glyph(font, font_file, char_index, rot=rot)
+        stored_scale = 1
+    else:
+        glyph, bit_width = _read_table_glyph(font_file, header, char_index)
+        if header[0] != rot:
+            glyph, bit_width = _rotate_glyph(glyph, bit_width, rot)
+        stored_scale = header[1]
+
+    if scale % stored_scale:
+        raise ValueError(
+            f"{font.bin_filename} is stored at scale {stored_scale}, can't draw at {scale}"
+        )
+    if scale != stored_scale:
+        glyph, bit_width = _scale_glyph(glyph, bit_width, scale // stored_scale)
+    return glyph, bit_width
+
+
+def _scale_glyph(glyph, bit_width, scale):
+    row_bytes = (bit_width + 7) >> 3
+    scaled_row_bytes = (bit_width * scale + 7) >> 3
+    scaled_glyph = bytearray(scaled_row_bytes * scale * (len(glyph) // row_bytes))
+    scaled_view = memoryview(scaled_glyph)
+    scaled_row = 0
+    for src_index in range(0, len(glyph), row_bytes):
+        base = scaled_row * scaled_row_bytes
+        for bit in range(bit_width):
+            if glyph[src_index + (bit >> 3)] & (0x80 >> (bit & 7)):
+                for scaled_bit in range(bit * scale, (bit + 1) * scale):
+                    scaled_glyph[base + (scaled_bit >> 3)] |= 0x80 >> (scaled_bit & 7)
+        for repeat in range(1, scale):
+            repeat_base = base + repeat * scaled_row_bytes
+            scaled_view[repeat_base : repeat_base + scaled_row_bytes] = scaled_view[
+                base : base + scaled_row_bytes
+            ]
+        scaled_row += scale
+    return scaled_glyph, bit_width * scale
+
+
+def get_glyph(font, char_index, rot=0, scale=1, font_file=None):
+    # Serves decoded glyphs from an LRU cache capped at GLYPH_CACHE_BUDGET
+    # bytes of bitmap data, only touching the font file on a miss.
+    global glyph_cache_bytes, glyph_cache_hits, glyph_cache_misses
+
+    key = (font.bin_filename, char_index, rot, scale)
+    if key in glyph_cache:
+        glyph_cache_hits += 1
+        glyph_cache_order.remove(key)
+        glyph_cache_order.append(key)
+        return glyph_cache[key]
+
+    glyph_cache_misses += 1
+    if font_file is None:
+        with open(font.bin_filename, "rb") as font_file:
+            glyph, bit_width = _load_glyph(font, font_file, char_index, rot, scale)
+    else:
+        glyph, bit_width = _load_glyph(font, font_file, char_index, rot, scale)
+
+    if len(glyph) <= GLYPH_CACHE_BUDGET:
+        while glyph_cache_bytes + len(glyph) > GLYPH_CACHE_BUDGET:
+            evicted_key = glyph_cache_order.pop(0)
+            glyph_cache_bytes -= len(glyph_cache.pop(evicted_key)[0])
+        glyph_cache[key] = (glyph, bit_width)
+        glyph_cache_order.append(key)
+        glyph_cache_bytes += len(glyph)
+    return glyph, bit_width
 
 
 def draw_character(
@@ -190,54 +710,27 @@ def draw_character(
     scale=1,
 ):
     if character not in font.chars:
-        if character != " ":
+        if DEBUG_LEVEL and character != " ":
             debug_print(f"Cannot draw character {character} as it's not in font")
         return
 
-    char_index = font.chars.index(character)
-    char_width = int(font.width / 8)
-
-    for y in range(font.height):
-        bit_offset = int(char_width * char_index + (len(font.chars) * char_width * y))
-        for x in range(char_width):
-            font_file.seek(bit_offset + x)
-            font_x_byte = font_file.read(1)[0]
-            for xi in range(8):
-                pixel_bit = int((font_x_byte & (2**xi)) == (2**xi))
-                # pixel_bit = font_x_byte & (2 ** xi)
-
-                if not invert:
-                    pixel_bit = int(not bool(pixel_bit))
-
-                if pixel_bit == transparent_color:
-                    continue
+    glyph, bit_width = get_glyph(
+        font, font.chars.index(character), rot=rot, scale=scale, font_file=font_file
+    )
+    row_bytes = (bit_width + 7) >> 3
+    row_count = len(glyph) // row_bytes
 
-                newx = (x * 8) + xi
-                newy = y
+    if rot == 1:
+        col = EPD_WIDTH + 2 - xoff - (font.height + 1) * scale
+    else:
+        col = EPD_WIDTH + 2 - xoff - font.width * scale
 
-                if rot == 1:
-                    newx = font.height - y
-                    newy = (x * 8) + xi
-
-                pixels = [(xoff + newx, yoff + newy, pixel_bit)]
-
-                if scale != 1:
-                    pixels = []
-                    newx *= scale
-                    newy *= scale
-                    for scalex in range(scale):
-                        for scaley in range(scale):
-                            pixels.append(
-                                (
-                                    xoff + newx + scalex,
-                                    yoff + newy + scaley,
-                                    pixel_bit,
-                                )
-                            )
-
-                for pixel in pixels:
-                    fbuf_pixel(*pixel)
-    gc.collect()
+    # ink is the dark part of the font, drawn white instead when inverted
+    ink_color = 0 if invert else 1
+    if transparent_color != 1 - ink_color:
+        fbuf_fill(col, yoff, col + bit_width, yoff + row_count, 1 - ink_color)
+    if transparent_color != ink_color:
+        fbuf_blit(glyph, row_bytes, col, yoff, ink_color)
 
 
 def draw_text(
@@ -252,7 +745,6 @@ def draw_text(
     scale=1,
 ):
     char_count = 0
-    font_file = open(font.bin_filename, "rb")
     if offset_for_length:
         offset_amount = font.width * ((len(text) / 2) * offset_for_length) * scale
         if rot == 0:
@@ -271,46 +763,20 @@ def draw_text(
             int(yoff + extra_yoff),
             character,
             font,
-            font_file,
+            None,
             invert=invert,
             transparent_color=transparent_color,
             rot=rot,
             scale=scale,
         )
         char_count += 1
-    font_file.close()
 
 
 def clean_fbuf():
-    global fbuf
-    for i in range(int(LINE_WIDTH * EPD_HEIGHT)):
-        fbuf[i] = 0xFF
-
-
-def draw_display_booting():
-    clean_fbuf()
-    gc.collect()
-
-    line_height_24 = comic_code_24.height + 4
+    _fill_bytes(0, FBUF_SIZE, 0xFF)
 
-    draw_text(
-        "avenet42",
-        int(EPD_WIDTH / 2),
-        int(EPD_HEIGHT / 2),
-        comic_code_24,
-        transparent_color=0,
-        rot=1,
-    )
-
-    draw_text(
-        "booting",
-        int(EPD_WIDTH / 2) - line_height_24,
-        int(EPD_HEIGHT / 2),
-        comic_code_24,
-        transparent_color=0,
-        rot=1,
-    )
 
+def draw_status_icons():
     if bt_enabled():
         draw_text(
             "Є",
@@ -332,59 +798,145 @@ def draw_display_booting():
             offset_for_length=False,
         )
 
-    display(fbuf)
-
-
-def draw_display(co2_ppm, celsius, rh, altitude: int | None = None):
-    if "cpu_frequency" in config["screen"]:
-        machine.freq(config["screen"]["cpu_frequency"])
 
+def _draw_display_template(co2_length):
+    # everything on the main screen that doesn't change between readings
     clean_fbuf()
     gc.collect()
     top_bar_height = int(EPD_WIDTH / 3)
 
+    # +2 runs the bar off the far edge of the panel
     fbuf_rect(
         int(EPD_WIDTH - top_bar_height),
         0,
-        top_bar_height,
+        top_bar_height + 2,
         EPD_HEIGHT,
         1,
     )
 
+    # no co2 reading, no unit either
+    if co2_length:
+        co2_offset = int(comic_code_48.width * (co2_length / 2))
+        draw_text(
+            "ppm",
+            int(EPD_WIDTH / 3) - comic_code_24.height + 12,
+            int(EPD_HEIGHT / 2) + co2_offset,
+            comic_code_24,
+            transparent_color=0,
+            rot=1,
+        )
+
+    draw_status_icons()
+
+
+def load_display_template(co2_length):
+    # Starts the frame from a copy of the static layout, which is only
+    # redrawn when the ppm label moves or the status icons change.
+    global template_fbuf, template_key
+
+    key = (co2_length, bt_enabled(), wlan_enabled())
+    if key == template_key:
+        fbuf_view[:] = template_fbuf
+        return
+
+    _draw_display_template(co2_length)
+    if template_fbuf is None:
+        template_fbuf = bytearray(FBUF_SIZE)
+    template_fbuf[:] = fbuf
+    template_key = key
+
+
+def _render_display_booting():
+    global last_display_fields
+
+    last_display_fields = None
+    clean_fbuf()
+    gc.collect()
+
+    line_height_24 = comic_code_24.height + 4
+
     draw_text(
-        "{:.1f}°C".format(celsius),
-        EPD_WIDTH - comic_code_24.height - 2,
-        5,
+        "avenet42",
+        int(EPD_WIDTH / 2),
+        int(EPD_HEIGHT / 2),
         comic_code_24,
+        transparent_color=0,
         rot=1,
-        invert=True,
-        transparent_color=1,
-        offset_for_length=False,
     )
 
-    co2_text = "{}".format(co2_ppm)
-    co2_offset = int(comic_code_48.width * (len(co2_text) / 2))
-    # 1.5 for len("ppm") / 2
-    ppm_offset = int(comic_code_24.width * 1.5)
     draw_text(
-        co2_text,
-        int(EPD_WIDTH / 3) - comic_code_24.height,
-        int(EPD_HEIGHT / 2) - ppm_offset,
-        comic_code_48,
+        "booting",
+        int(EPD_WIDTH / 2) - line_height_24,
+        int(EPD_HEIGHT / 2),
+        comic_code_24,
         transparent_color=0,
         rot=1,
     )
+
+    draw_status_icons()
+
+
+def draw_display_booting():
+    _render_display_booting()
+    display(fbuf)
+
+
+async def draw_display_booting_async():
+    _render_display_booting()
+    await display_async(fbuf)
+
+
+def _render_display(co2_ppm, celsius, rh, altitude: int | None = None) -> bool:
+    # renders the main screen into fbuf, returns False if it's unchanged
+    global last_display_fields, skipped_refreshes
+
+    # everything that ends up on screen, as it'll be rendered
+    display_fields = (
+        "" if co2_ppm is None else "{}".format(co2_ppm),
+        "{:.1f}°C".format(celsius),
+        "{:.0f}% RH".format(rh),
+        None if altitude is None else "{:.0f}m".format(altitude),
+        "{}".format(gc.mem_free()) if config["screen"]["debug"] else None,
+        bt_enabled(),
+        wlan_enabled(),
+    )
+    if display_fields == last_display_fields:
+        skipped_refreshes += 1
+        debug_print("Screen contents unchanged, skipping refresh")
+        return False
+    last_display_fields = display_fields
+    co2_text, celsius_text, rh_text, altitude_text, mem_text, _, _ = display_fields
+
+    if "cpu_frequency" in config["screen"]:
+        machine.freq(config["screen"]["cpu_frequency"])
+
+    load_display_template(len(co2_text))
+
     draw_text(
-        "ppm",
-        int(EPD_WIDTH / 3) - comic_code_24.height + 12,
-        int(EPD_HEIGHT / 2) + co2_offset,
+        celsius_text,
+        EPD_WIDTH - comic_code_24.height - 2,
+        5,
         comic_code_24,
-        transparent_color=0,
         rot=1,
+        invert=True,
+        transparent_color=1,
+        offset_for_length=False,
     )
 
+    if co2_text:
+        # 1.5 for len("ppm") / 2
+        ppm_offset = int(comic_code_24.width * 1.5)
+        draw_text(
+            co2_text,
+            int(EPD_WIDTH / 3) - comic_code_24.height,
+            int(EPD_HEIGHT / 2) - ppm_offset,
+            comic_code_48,
+            transparent_color=0,
+            rot=1,
+        )
+
     draw_text(
-        "{:.0f}% RH".format(rh),
+        rh_text,
         EPD_WIDTH - comic_code_24.height - 2,
         EPD_HEIGHT - 5,
         comic_code_24,
@@ -394,9 +946,9 @@ def draw_display(co2_ppm, celsius, rh, altitude: int | None = None):
         offset_for_length=2,
     )
 
-    if altitude is not None:
+    if altitude_text is not None:
         draw_text(
-            "{:.0f}m".format(altitude),
+            altitude_text,
             int(EPD_WIDTH / 1.5) - comic_code_24.height - 2,
             EPD_HEIGHT - 5,
             comic_code_24,
@@ -405,30 +957,9 @@ def draw_display(co2_ppm, celsius, rh, altitude: int | None = None):
             offset_for_length=2,
         )
 
-    if bt_enabled():
-        draw_text(
-            "Є",
-            0,
-            0,
-            comic_code_24,
-            rot=1,
-            transparent_color=0,
-            offset_for_length=False,
-        )
-    if wlan_enabled():
-        draw_text(
-            "$",
-            comic_code_24.height,
-            0,
-            comic_code_24,
-            rot=1,
-            transparent_color=0,
-            offset_for_length=False,
-        )
-
-    if config["screen"]["debug"]:
+    if mem_text is not None:
         draw_text(
-            "{}".format(gc.mem_free()),
+            mem_text,
             0,
             EPD_HEIGHT - comic_code_24.height,
             comic_code_24,
@@ -436,9 +967,19 @@ def draw_display(co2_ppm, celsius, rh, altitude: int | None = None):
             offset_for_length=False,
         )
 
-    display(fbuf)
+    return True
+
+
+def draw_display(co2_ppm, celsius, rh, altitude: int | None = None):
+    if _render_display(co2_ppm, celsius, rh, altitude=altitude):
+        display(fbuf)
+        set_cpu_freq_by_config()
+
 
-    set_cpu_freq_by_config()
+async def draw_display_async(co2_ppm, celsius, rh, altitude: int | None = None):
+    if _render_display(co2_ppm, celsius, rh, altitude=altitude):
+        await display_async(fbuf)
+        set_cpu_freq_by_config()
 
 
 if __name__ == "__main__":
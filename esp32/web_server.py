@@ -1,7 +1,7 @@
 import uasyncio
 import network
 import json
-from helpers import debug_print, config, ensure_wlan_connected
+from helpers import debug_print, read_debug_log, config, ensure_wlan_connected
 
 WEBSERVER_RUNNING = False
 STATUS_DATA = {}
@@ -52,7 +52,8 @@ def generate_response(
         [
             f"HTTP/1.1 {status_code} {STATUS_CODE_TEXT.get(status_code, '')}\r\n",
             "Connection: close\r\n",
-            f"Content-Length: {len(response_body)}\r\n",
+            # in bytes, the debug log isn't always ascii
+            f"Content-Length: {len(response_body.encode())}\r\n",
             f"Content-Type: {content_type}\r\n\r\n",
             response_body,
         ]
@@ -87,13 +88,19 @@ async def server_callback(reader: uasyncio.StreamReader, writer: uasyncio.Stream
                 generate_status_body("prometheus", STATUS_DATA),
                 content_type="text/plain; version=0.0.4",
             )
+        elif req_header.startswith(b"GET /debug.log"):
+            resp = generate_response(
+                200,
+                read_debug_log().decode(),
+                content_type="text/plain; charset=utf-8",
+            )
         elif req_header.startswith(b"GET / "):
             resp = generate_response(
                 200,
                 (
                     "<head><title>avenet42</title></head>\n"
                     'hi! this is an <a href="https://github.com/aveao/avenet42">avenet42</a>.<br>\n'
-                    'try <a href="/status.json">/status.json</a> or <a href="/prometheus">/prometheus</a>.'
+                    'try <a href="/status.json">/status.json</a>, <a href="/prometheus">/prometheus</a> or <a href="/debug.log">/debug.log</a>.'
                 ),
             )
         else:
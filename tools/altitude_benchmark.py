@@ -0,0 +1,112 @@
+"""Compares helpers.fast_pressure_to_altitude against pressure_to_altitude.
+
+usage: python3 altitude_benchmark.py [step in Pa]
+       mpremote run altitude_benchmark.py
+
+Sweeps the table's pressure range for a few sea level pressures, and fails if
+the table is ever further than MAX_ERROR_M from the exact formula. Then times
+both functions over the same range, with the heap allocated per call where
+gc.mem_alloc is there to tell.
+
+CPython's float maths is cheap, so on the host the timings mostly show call
+overhead and say nothing about the ESP32. To decide between the two, run it on
+a board that has helpers.py and a config.json on it, where micropython's
+single precision floats, the fractional power and the float allocations are
+what gets measured.
+"""
+
+import gc
+import sys
+import time
+
+if sys.implementation.name != "micropython":
+    import display_emulator
+
+    display_emulator.install()
+
+import helpers  # noqa: E402
+
+step_pa = float(sys.argv[1]) if len(sys.argv) > 1 else 3.7
+# the bound documented on fast_pressure_to_altitude
+MAX_ERROR_M = 0.15
+SEA_LEVELS_PA = [95000, 101325, 103500]
+# integer readings like bmp180's, the range is walked rather than kept in RAM
+TIMING_STEP_PA = 16
+
+
+def ticks_us():
+    if hasattr(time, "ticks_us"):
+        return time.ticks_us()
+    return int(time.perf_counter() * 1e6)
+
+
+def ticks_diff(end, start):
+    if hasattr(time, "ticks_diff"):
+        return time.ticks_diff(end, start)
+    return end - start
+
+
+failures = 0
+for sea_level_pa in SEA_LEVELS_PA:
+    worst_m = worst_pa = 0
+    pressure_count = 0
+    pressure_pa = helpers.ALTITUDE_TABLE_MIN_PA
+    while pressure_pa <= helpers.ALTITUDE_TABLE_MAX_PA:
+        error_m = abs(
+            helpers.fast_pressure_to_altitude(pressure_pa, sea_level_pa)
+            - helpers.pressure_to_altitude(pressure_pa / 100, sea_level_pa / 100)
+        )
+        if error_m > worst_m:
+            worst_m, worst_pa = error_m, pressure_pa
+        pressure_count += 1
+        pressure_pa += step_pa
+    ok = worst_m <= MAX_ERROR_M
+    failures += not ok
+    print(
+        "{} sea level {}Pa: worst error {:.3f}m at {:.0f}Pa (limit {}m) "
+        "over {} pressures".format(
+            "ok  " if ok else "FAIL",
+            sea_level_pa,
+            worst_m,
+            worst_pa,
+            MAX_ERROR_M,
+            pressure_count,
+        )
+    )
+
+# the table's own build isn't timed
+helpers.fast_pressure_to_altitude(helpers.ALTITUDE_TABLE_MIN_PA)
+timed_pressures = range(
+    helpers.ALTITUDE_TABLE_MIN_PA, helpers.ALTITUDE_TABLE_MAX_PA, TIMING_STEP_PA
+)
+for label, function in (
+    ("loop only", lambda p: p),
+    ("pressure_to_altitude", lambda p: helpers.pressure_to_altitude(p / 100)),
+    ("fast_pressure_to_altitude", helpers.fast_pressure_to_altitude),
+):
+    gc.collect()
+    gc.disable()
+    allocated = gc.mem_alloc() if hasattr(gc, "mem_alloc") else None
+    start = ticks_us()
+    for pressure_pa in timed_pressures:
+        function(pressure_pa)
+    duration_us = ticks_diff(ticks_us(), start) / len(timed_pressures)
+    if allocated is not None:
+        allocated = (gc.mem_alloc() - allocated) / len(timed_pressures)
+    gc.enable()
+    print(
+        "{:<26} {:.3f}us per call{}".format(
+            label,
+            duration_us,
+            "" if allocated is None else ", {:.1f} bytes allocated".format(allocated),
+        )
+    )
+
+print(
+    "table: {} entries, {} bytes".format(
+        len(helpers.altitude_table),
+        len(helpers.altitude_table) * helpers.altitude_table.itemsize,
+    )
+)
+
+sys.exit(1 if failures else 0)
@@ -0,0 +1,193 @@
+"""Checks BMP180's integer temperature/pressure maths on the host, and times it.
+
+usage: python3 bmp180_test_vectors.py [iterations]
+
+The datasheet example (section 3.5) has to match exactly. A sweep over raw
+readings is compared against the same formulas evaluated in floats without
+any intermediate rounding, which the integer pipeline should stay close to.
+"""
+
+import asyncio
+import sys
+import time
+
+import display_emulator
+
+display_emulator.install()
+
+from bmp180 import BMP180  # noqa: E402
+
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+# calibration from the datasheet example
+DATASHEET_CALIBRATION = {
+    "AC1": 408,
+    "AC2": -72,
+    "AC3": -14383,
+    "AC4": 32741,
+    "AC5": 32757,
+    "AC6": 23153,
+    "VB1": 6190,
+    "VB2": 4,
+    "MB": -32768,
+    "MC": -8711,
+    "MD": 2868,
+}
+# (UT, UP, oversample mode, B5, temperature in 0.1C, pressure in Pa)
+DATASHEET_VECTORS = [(27898, 23843, 0, 2399, 150, 69964)]
+# maximum distance from the unrounded float reference, the datasheet's
+# truncating steps cost the most at oversample mode 0. The sensor itself is
+# only accurate to about 100Pa.
+SWEEP_TOLERANCE_PA = 10
+# the sensor's operating range
+SWEEP_PRESSURE_RANGE_PA = (30000, 110000)
+
+
+def reference_pressure(calibration, pressure_raw, B5, oversample_mode):
+    B6 = B5 - 4000
+    X3 = (
+        calibration["VB2"] * (B6 * B6 / 2**12) / 2**11 + calibration["AC2"] * B6 / 2**11
+    )
+    B3 = ((calibration["AC1"] * 4 + X3) * 2**oversample_mode + 2) / 4
+    X3 = (
+        calibration["AC3"] * B6 / 2**13
+        + calibration["VB1"] * (B6 * B6 / 2**12) / 2**16
+        + 2
+    ) / 4
+    B4 = calibration["AC4"] * (X3 + 32768) / 2**15
+    pascal = (pressure_raw - B3) * (50000 / 2**oversample_mode) * 2 / B4
+    X1 = (pascal / 2**8) ** 2 * 3038 / 2**16
+    X2 = -7357 * pascal / 2**16
+    return pascal + (X1 + X2 + 3791) / 2**4
+
+
+def legacy_float_pressure(calibration, pressure_raw, temp_raw, oversample_mode):
+    # the float pipeline this replaced, B5 rebuilt from the rounded temperature
+    X1 = (temp_raw - calibration["AC6"]) * calibration["AC5"] >> 15
+    X2 = (calibration["MC"] << 11) / (X1 + calibration["MD"])
+    temp = (int(X1 + X2 + 8) >> 4) / 10
+    B5_raw = (int(temp * 10) << 4) - 8
+    B6 = B5_raw - 4000
+    X1 = (calibration["VB2"] * (B6**2 / 2**12)) / 2**11
+    X2 = calibration["AC2"] * B6 / 2**11
+    X3 = X1 + X2
+    B3 = ((int((calibration["AC1"] * 4 + X3)) << oversample_mode) + 2) / 4
+    X1 = calibration["AC3"] * B6 / 2**13
+    X2 = (calibration["VB1"] * (B6**2 / 2**12)) / 2**16
+    X3 = ((X1 + X2) + 2) / 2**2
+    B4 = abs(calibration["AC4"]) * (X3 + 32768) / 2**15
+    B7 = (abs(pressure_raw) - B3) * (50000 >> oversample_mode)
+    if B7 < 0x80000000:
+        pascal = (B7 * 2) / B4
+    else:
+        pascal = (B7 / B4) * 2
+    X1 = (pascal / 2**8) ** 2
+    X1 = (X1 * 3038) / 2**16
+    X2 = (-7357 * pascal) / 2**16
+    return pascal + (X1 + X2 + 3791) / 2**4
+
+
+class FakeI2C:
+    """Serves one raw temperature and pressure reading, like the chip would."""
+
+    def __init__(self, temp_raw, pressure_raw, oversample_mode):
+        self.registers = {
+            0x2E: temp_raw.to_bytes(2, "big"),
+            0x34: (pressure_raw << (8 - oversample_mode)).to_bytes(3, "big"),
+        }
+        self.conversion = None
+
+    def writeto(self, address, command):
+        if command[0] == 0xF4:
+            self.conversion = command[1] & 0x3F
+
+    def readfrom(self, address, size):
+        return self.registers[self.conversion][:size]
+
+
+def make_sensor(calibration, i2c=None):
+    sensor = BMP180(i2c)
+    sensor.calibration = dict(calibration)
+    return sensor
+
+
+failures = 0
+sensor = make_sensor(DATASHEET_CALIBRATION)
+
+for temp_raw, pressure_raw, oversample_mode, B5, temp, pascal in DATASHEET_VECTORS:
+    got_B5 = sensor._compute_b5(temp_raw)
+    got_temp = (got_B5 + 8) >> 4
+    got_pascal = sensor._compute_pressure(pressure_raw, got_B5, oversample_mode)
+    ok = (got_B5, got_temp, got_pascal) == (B5, temp, pascal)
+    failures += not ok
+    print(
+        f"{'ok  ' if ok else 'FAIL'} datasheet UT={temp_raw} UP={pressure_raw} "
+        f"oss={oversample_mode}: B5={got_B5} T={got_temp} p={got_pascal}Pa "
+        f"(expected B5={B5} T={temp} p={pascal}Pa)"
+    )
+
+    # and through the driver's I2C path
+    i2c_sensor = make_sensor(
+        DATASHEET_CALIBRATION, FakeI2C(temp_raw, pressure_raw, oversample_mode)
+    )
+    got_temp = asyncio.run(i2c_sensor.read_temperature())
+    got_pascal = asyncio.run(i2c_sensor.read_pressure(oversample_mode))
+    ok = (got_temp, got_pascal) == (temp / 10, pascal)
+    failures += not ok
+    print(f"{'ok  ' if ok else 'FAIL'} driver read: T={got_temp}C p={got_pascal}Pa")
+
+sweep = []
+for oversample_mode in range(4):
+    for temp_raw in range(20000, 36000, 1000):
+        for up in range(18000, 44000, 250):
+            sweep.append((up << oversample_mode, temp_raw, oversample_mode))
+
+worst = legacy_worst = swept = 0
+for pressure_raw, temp_raw, oversample_mode in sweep:
+    B5 = sensor._compute_b5(temp_raw)
+    reference = reference_pressure(
+        DATASHEET_CALIBRATION, pressure_raw, B5, oversample_mode
+    )
+    if not SWEEP_PRESSURE_RANGE_PA[0] <= reference <= SWEEP_PRESSURE_RANGE_PA[1]:
+        continue
+    swept += 1
+    worst = max(
+        worst,
+        abs(sensor._compute_pressure(pressure_raw, B5, oversample_mode) - reference),
+    )
+    legacy_worst = max(
+        legacy_worst,
+        abs(
+            legacy_float_pressure(
+                DATASHEET_CALIBRATION, pressure_raw, temp_raw, oversample_mode
+            )
+            - reference
+        ),
+    )
+ok = worst <= SWEEP_TOLERANCE_PA
+failures += not ok
+print(
+    f"{'ok  ' if ok else 'FAIL'} sweep of {swept} readings: integer off by "
+    f"<= {worst:.2f}Pa (limit {SWEEP_TOLERANCE_PA}Pa), "
+    f"previous float pipeline <= {legacy_worst:.2f}Pa"
+)
+
+vectors = sweep[:iterations]
+start = time.perf_counter()
+for pressure_raw, temp_raw, oversample_mode in vectors:
+    sensor._compute_pressure(
+        pressure_raw, sensor._compute_b5(temp_raw), oversample_mode
+    )
+integer_us = (time.perf_counter() - start) * 1e6 / len(vectors)
+start = time.perf_counter()
+for pressure_raw, temp_raw, oversample_mode in vectors:
+    legacy_float_pressure(
+        DATASHEET_CALIBRATION, pressure_raw, temp_raw, oversample_mode
+    )
+float_us = (time.perf_counter() - start) * 1e6 / len(vectors)
+print(
+    f"per reading over {len(vectors)}: integer {integer_us:.2f}us, "
+    f"previous float {float_us:.2f}us"
+)
+
+sys.exit(1 if failures else 0)
@@ -0,0 +1,70 @@
+"""Times waveshare213's render paths on the host, through display_emulator.
+
+usage: python3 display_benchmark.py [iterations] [config overrides as json]
+e.g.   python3 display_benchmark.py 200 '{"screen": {"partial_refresh": true}}'
+
+Host timings are only useful relative to each other, to compare a change to
+the render path against the one before it.
+"""
+
+import json
+import sys
+import time
+
+import display_emulator
+
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+overrides = json.loads(sys.argv[2]) if len(sys.argv) > 2 else {}
+panel = display_emulator.install(overrides)
+
+import waveshare213  # noqa: E402
+
+# a spread of on-screen values, so frame skipping doesn't hide the render cost
+co2_values = [400, 415, 999, 1000, 1234, 2500, 5000, 420]
+celsius_values = [-5.25, 0.0, 18.4, 21.55, 25.0]
+rh_values = [0.0, 35.5, 50.69, 99.9]
+altitude_values = [None, -12, 110, 1650]
+
+
+def value_combinations(count):
+    for i in range(count):
+        yield (
+            co2_values[i % len(co2_values)] + i,
+            celsius_values[i % len(celsius_values)],
+            rh_values[i % len(rh_values)],
+            altitude_values[i % len(altitude_values)],
+        )
+
+
+def timed(label, function, arguments):
+    durations = []
+    for args in arguments:
+        start = time.perf_counter()
+        function(*args)
+        durations.append((time.perf_counter() - start) * 1000)
+    durations.sort()
+    print(
+        f"{label:<24} n={len(durations):<5} "
+        f"mean={sum(durations) / len(durations):8.3f}ms "
+        f"median={durations[len(durations) // 2]:8.3f}ms "
+        f"max={durations[-1]:8.3f}ms"
+    )
+
+
+waveshare213.init_display()
+timed("draw_display_booting", waveshare213.draw_display_booting, [()] * iterations)
+timed(
+    "draw_display",
+    lambda co2, celsius, rh, altitude: waveshare213.draw_display(
+        co2, celsius, rh, altitude=altitude
+    ),
+    value_combinations(iterations),
+)
+timed("display", waveshare213.display, [(waveshare213.fbuf,)] * iterations)
+
+print(
+    f"panel refreshes={len(panel.frames)} spi bytes={panel.bytes_written} "
+    f"skipped refreshes={waveshare213.skipped_refreshes} "
+    f"glyph cache hits={waveshare213.glyph_cache_hits} "
+    f"misses={waveshare213.glyph_cache_misses}"
+)
@@ -0,0 +1,281 @@
+"""Host-side emulation of the display hardware, for running waveshare213 off-device.
+
+install() stubs out the micropython-only modules (machine, utime, uasyncio...)
+with just enough behaviour for waveshare213 to import and render. It sets up a
+working directory with a config.json built from config.json.template and the
+font/LUT files. The stubbed SPI bus feeds a model of the display controller,
+which rebuilds the frames the panel would show.
+
+    import display_emulator
+    panel = display_emulator.install({"screen": {"partial_refresh": True}})
+    import waveshare213
+    waveshare213.init_display()
+    waveshare213.draw_display(420, 21.5, 40)
+    panel.save_pbm("frame.pbm")
+"""
+
+import asyncio
+import binascii
+import gc
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import types
+
+ESP32_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "esp32")
+
+
+class Panel:
+    """Model of the display controller's RAM, fed from the SPI bus.
+
+    Handles the RAM window (0x44/0x45), address counters (0x4E/0x4F) and RAM
+    writes (0x24/0x26) in the X increment, Y decrement data entry mode that
+    init_display sets. Every refresh (0x20) snapshots the black/white RAM into
+    frames, with the matching update control in update_controls.
+    """
+
+    def __init__(self, width, height):
+        self.line_width = (width + 7) // 8
+        self.height = height
+        self.ram = {
+            0x24: bytearray(b"\xff" * self.line_width * height),
+            0x26: bytearray(self.line_width * height),
+        }
+        self.frames = []
+        self.update_controls = []
+        self.bytes_written = 0
+        self.dc = 0
+        self._command = None
+        self._args = bytearray()
+        self._update_control = 0xC7
+        self._reset_window()
+
+    def _reset_window(self):
+        self.x_start, self.x_end = 0, self.line_width - 1
+        self.y_start, self.y_end = self.height - 1, 0
+        self.x, self.y = self.x_start, self.y_start
+
+    def _finish_command(self):
+        args = self._args
+        if self._command == 0x12:
+            self._reset_window()
+        elif self._command == 0x44 and len(args) >= 2:
+            self.x_start, self.x_end = args[0], args[1]
+        elif self._command == 0x45 and len(args) >= 4:
+            self.y_start = args[0] | (args[1] << 8)
+            self.y_end = args[2] | (args[3] << 8)
+        elif self._command == 0x4E and args:
+            self.x = args[0]
+        elif self._command == 0x4F and len(args) >= 2:
+            self.y = args[0] | (args[1] << 8)
+        elif self._command == 0x22 and args:
+            self._update_control = args[0]
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        if self.dc == 0:
+            for command in data:
+                self._finish_command()
+                self._command = command
+                self._args = bytearray()
+                if command == 0x20:
+                    self.frames.append(bytes(self.ram[0x24]))
+                    self.update_controls.append(self._update_control)
+            return
+
+        if self._command not in self.ram:
+            self._args += data
+            return
+
+        ram = self.ram[self._command]
+        for value in data:
+            ram[(self.height - 1 - self.y) * self.line_width + self.x] = value
+            self.x += 1
+            if self.x > self.x_end:
+                self.x = self.x_start
+                self.y -= 1
+                if self.y < self.y_end:
+                    self.y = self.y_start
+
+    def pixel_rows(self, frame=-1, landscape=True):
+        """Rows of pixels (True for black) of a refreshed frame.
+
+        landscape turns the image the way the screen is read, with buffer rows
+        running left to right."""
+        frame_buf = self.frames[frame] if self.frames else self.ram[0x24]
+        columns = self.line_width * 8
+
+        def black(row, col):
+            return not frame_buf[row * self.line_width + col // 8] & (0x80 >> (col % 8))
+
+        if landscape:
+            return [
+                [black(row, col) for row in range(self.height)]
+                for col in range(columns)
+            ]
+        return [
+            [black(row, col) for col in range(columns)] for row in range(self.height)
+        ]
+
+    def save_pbm(self, path, frame=-1, landscape=True):
+        rows = self.pixel_rows(frame, landscape=landscape)
+        with open(path, "wb") as f:
+            f.write(f"P4\n{len(rows[0])} {len(rows)}\n".encode())
+            for row in rows:
+                packed = bytearray((len(row) + 7) // 8)
+                for x, pixel in enumerate(row):
+                    if pixel:
+                        packed[x // 8] |= 0x80 >> (x % 8)
+                f.write(packed)
+
+    def save_png(self, path, frame=-1, landscape=True):
+        from PIL import Image
+
+        rows = self.pixel_rows(frame, landscape=landscape)
+        image = Image.new("1", (len(rows[0]), len(rows)), 1)
+        for y, row in enumerate(rows):
+            for x, pixel in enumerate(row):
+                if pixel:
+                    image.putpixel((x, y), 0)
+        image.save(path)
+
+
+def _merge(base, overrides):
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            _merge(base[key], value)
+        else:
+            base[key] = value
+
+
+def install(config_overrides=None, work_dir=None):
+    """Stub the micropython modules, set up a working directory and return the
+    Panel that the emulated SPI bus writes into."""
+    with open(os.path.join(ESP32_DIR, "config.json.template")) as f:
+        config = json.load(f)
+    config["debug"] = 0
+    _merge(config, config_overrides or {})
+
+    work_dir = work_dir or tempfile.mkdtemp(prefix="avenet42-")
+    for filename in os.listdir(ESP32_DIR):
+        if filename.endswith(".bin"):
+            shutil.copy(os.path.join(ESP32_DIR, filename), work_dir)
+    with open(os.path.join(work_dir, "config.json"), "w") as f:
+        json.dump(config, f)
+    os.chdir(work_dir)
+    if ESP32_DIR not in sys.path:
+        sys.path.insert(0, ESP32_DIR)
+
+    panel = Panel(config["screen"]["width"], config["screen"]["height"])
+    busy_pin = config["pins"]["screen_busy"]
+    dc_pin = config["pins"]["screen_dc"]
+
+    class Pin:
+        IN = 0
+        OUT = 1
+        PULL_UP = 2
+        IRQ_FALLING = 2
+        IRQ_RISING = 1
+
+        def __init__(self, pin_id, mode=None, pull=None, value=None):
+            self.pin_id = pin_id
+            # inputs read as pulled up, so the BT/WLAN switches are on
+            self._value = 1 if value is None else value
+
+        def __call__(self, value=None):
+            return self.value(value)
+
+        def value(self, value=None):
+            if value is None:
+                # the emulated panel is never busy
+                return 0 if self.pin_id == busy_pin else self._value
+            self._value = value
+            if self.pin_id == dc_pin:
+                panel.dc = value
+
+        def irq(self, *args, **kwargs):
+            pass
+
+    class SPI:
+        MSB = 0
+
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def init(self, *args, **kwargs):
+            pass
+
+        def write(self, data):
+            panel.write(bytes(data))
+
+    machine = types.ModuleType("machine")
+    machine.Pin = Pin
+    machine.SPI = machine.SoftSPI = SPI
+    machine.I2C = machine.SoftI2C = object
+    machine.lightsleep = lambda duration_ms: None
+    machine.freq = lambda frequency=None: 240000000
+    machine.reset = lambda: None
+    sys.modules["machine"] = machine
+
+    # micropython's time has ticks, utime is the same module there
+    time.ticks_ms = lambda: int(time.monotonic() * 1000)
+    time.ticks_us = lambda: int(time.monotonic() * 1000000)
+    time.ticks_diff = lambda new, old: new - old
+    time.ticks_add = lambda ticks, delta: ticks + delta
+    time.sleep_ms = lambda duration_ms: time.sleep(duration_ms / 1000)
+    sys.modules["utime"] = time
+
+    uasyncio = types.ModuleType("uasyncio")
+    uasyncio.__dict__.update(
+        {key: value for key, value in asyncio.__dict__.items() if key[0] != "_"}
+    )
+    uasyncio.sleep_ms = lambda duration_ms: asyncio.sleep(duration_ms / 1000)
+    uasyncio.wait_for_ms = lambda awaitable, timeout_ms: asyncio.wait_for(
+        awaitable, timeout_ms / 1000
+    )
+    sys.modules["uasyncio"] = uasyncio
+
+    network = types.ModuleType("network")
+    network.STA_IF = 0
+    network.WLAN = object
+    sys.modules["network"] = network
+
+    # the clock stays as the host's
+    ntptime = types.ModuleType("ntptime")
+    ntptime.settime = lambda: None
+    sys.modules["ntptime"] = ntptime
+
+    bluetooth = types.ModuleType("bluetooth")
+    bluetooth.UUID = lambda uuid: uuid
+    sys.modules["bluetooth"] = bluetooth
+
+    micropython = types.ModuleType("micropython")
+    micropython.const = lambda value: value
+    sys.modules["micropython"] = micropython
+
+    sys.modules["ubinascii"] = binascii
+    sys.modules["ustruct"] = struct
+    sys.modules["uos"] = os
+    if not hasattr(gc, "mem_free"):
+        gc.mem_free = lambda: 0
+
+    return panel
+
+
+if __name__ == "__main__":
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else "."
+    output_dir = os.path.abspath(output_dir)
+    emulated_panel = install()
+
+    import waveshare213
+
+    waveshare213.init_display()
+    waveshare213.draw_display_booting()
+    emulated_panel.save_pbm(os.path.join(output_dir, "booting.pbm"))
+    waveshare213.draw_display(420, 21.5, 40.2, altitude=110)
+    emulated_panel.save_pbm(os.path.join(output_dir, "display.pbm"))
+    print("wrote booting.pbm and display.pbm to", output_dir)
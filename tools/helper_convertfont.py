@@ -1,4 +1,5 @@
 from PIL import Image
+import struct
 
 # note: font width needs to be 8-aligned
 
@@ -16,6 +17,16 @@ font_chars = "Є$CRHbotingavenepm1234567890-.°%"
 # font_height = 72
 # font_chars = "1234567890"
 
+# 0 writes the legacy row-interleaved strip instead of the glyph table format
+output_format = 2
+# rotation and scale the glyphs are stored in, should match how they're drawn
+output_rotation = 1
+output_scale = 1
+
+FONT_MAGIC = b"A42F"
+FONT_VERSION = 1
+FONT_HEADER_FORMAT = "<4sBBBBHH"
+
 
 def convert_image_to_bits(image_path):
     # partly generated with chatgpt :skull:
@@ -89,6 +100,76 @@ def bytes_get_character(bytes_array, character):
     return char_bits
 
 
+def pack_bit_rows(bit_rows):
+    packed = []
+    for bit_row in bit_rows:
+        row_bytes = [0] * ((len(bit_row) + 7) // 8)
+        for bit_index, bit in enumerate(bit_row):
+            if bit:
+                row_bytes[bit_index // 8] |= 0x80 >> (bit_index % 8)
+        packed += row_bytes
+    return packed
+
+
+def glyph_blit_rows(char_bits, rotation, scale):
+    # ink (dark) pixels as MSB-first bit rows in the display buffer's order,
+    # see _decode_glyph in waveshare213.py
+    if rotation == 1:
+        bit_rows = [
+            [1 - char_bits[y * font_width + x] for y in range(font_height)]
+            for x in range(font_width)
+        ]
+    else:
+        # buffer columns are mirrored to screen x
+        bit_rows = [
+            [
+                1 - char_bits[y * font_width + (font_width - 1 - x)]
+                for x in range(font_width)
+            ]
+            for y in range(font_height)
+        ]
+
+    scaled_rows = []
+    for bit_row in bit_rows:
+        scaled_row = [bit for bit in bit_row for _ in range(scale)]
+        scaled_rows += [scaled_row] * scale
+    return scaled_rows
+
+
+def build_glyph_table_font(bits_array):
+    """Build the glyph table font format.
+
+    Layout: header (FONT_HEADER_FORMAT), one uint32 absolute offset per glyph,
+    then each glyph's bit rows stored contiguously, ready to blit."""
+    glyphs = [
+        glyph_blit_rows(
+            bits_get_character(bits_array, font_char), output_rotation, output_scale
+        )
+        for font_char in font_chars
+    ]
+    bit_width = len(glyphs[0][0])
+    row_count = len(glyphs[0])
+
+    header = struct.pack(
+        FONT_HEADER_FORMAT,
+        FONT_MAGIC,
+        FONT_VERSION,
+        output_rotation,
+        output_scale,
+        len(font_chars),
+        bit_width,
+        row_count,
+    )
+    data_offset = len(header) + 4 * len(font_chars)
+    offset_table = b""
+    glyph_data = b""
+    for glyph in glyphs:
+        offset_table += struct.pack("<I", data_offset + len(glyph_data))
+        glyph_data += bytes(pack_bit_rows(glyph))
+
+    return header + offset_table + glyph_data
+
+
 bits_array = convert_image_to_bits(input_name)
 
 bytes_array = convert_bits_to_bytes(bits_array)
@@ -108,4 +189,7 @@ with open(output_dir + output_name, "w") as f:
 
 
 with open(output_dir + output_name_bin, "wb") as f:
-    f.write(bytes(bytes_array))
+    if output_format == 2:
+        f.write(build_glyph_table_font(bits_array))
+    else:
+        f.write(bytes(bytes_array))
@@ -0,0 +1,709 @@
+"""Host-side simulated I2C bus, with models of the SCD41, BMP280 and BMP180.
+
+install() builds on display_emulator.install(): machine.I2C and SoftI2C hand
+out a SimulatedI2C with the chosen sensors on it, and utime, lightsleep and
+uasyncio.run run on a VirtualClock, so a whole measurement cycle takes as
+long as the code takes to run rather than the seconds it sleeps for.
+
+    import i2c_simulator
+    simulation = i2c_simulator.install()
+    import scd41
+    ...
+    simulation.clock.run(coroutine, duration_s=600)
+
+The sensors read their surroundings from an environment, a function from
+virtual time in seconds to a dict with co2 (ppm), celsius, rh (%) and
+pressure_pa. default_environment is scripted, recorded_environment replays a
+CSV file.
+
+Each model keeps to its datasheet's command set, register map, CRCs and
+conversion times. Commands sent while the chip is busy, or reads before the
+data is there, are NACKed with OSError like the real bus does.
+"""
+
+import asyncio
+import csv
+import errno
+import math
+import random
+import sys
+import time
+import types
+
+import display_emulator
+
+# datasheet calibrations, so the results can be checked against the examples
+BMP280_CALIBRATION = (
+    27504,
+    26435,
+    -1000,
+    36477,
+    -10685,
+    3024,
+    2855,
+    140,
+    -7,
+    15500,
+    -14600,
+    6000,
+)
+BMP180_CALIBRATION = (
+    408,
+    -72,
+    -14383,
+    32741,
+    32757,
+    23153,
+    6190,
+    4,
+    -32768,
+    -8711,
+    2868,
+)
+
+
+def _nack():
+    # what micropython raises when a device doesn't acknowledge
+    return OSError(errno.ENODEV, "NACK")
+
+
+def default_environment(time_s):
+    # a room slowly filling up with co2 over an hour, with some weather
+    return {
+        "co2": int(420 + 580 * (1 - math.cos(2 * math.pi * time_s / 3600)) / 2),
+        "celsius": 21.5 + 1.5 * math.sin(2 * math.pi * time_s / 5400),
+        "rh": 45 + 5 * math.sin(2 * math.pi * time_s / 7200),
+        "pressure_pa": 101325 + 150 * math.sin(2 * math.pi * time_s / 10800),
+    }
+
+
+def recorded_environment(path, step_s):
+    """Replays a CSV file with a header of some of co2, celsius, rh and
+    pressure_pa, one row every step_s. Missing columns come from
+    default_environment, the last row holds once the file runs out."""
+    with open(path) as f:
+        rows = [
+            {key: float(value) for key, value in row.items() if value != ""}
+            for row in csv.DictReader(f)
+        ]
+
+    def environment(time_s):
+        values = default_environment(time_s)
+        values.update(rows[min(int(time_s / step_s), len(rows) - 1)])
+        values["co2"] = int(values["co2"])
+        return values
+
+    return environment
+
+
+class VirtualClock:
+    """Simulated time, in seconds. Blocking sleeps move it forward straight
+    away, run() runs a coroutine on an event loop that skips ahead to the
+    next timer whenever there's nothing else to do."""
+
+    def __init__(self, rtc_s=1767225600):
+        self.now = 0.0
+        # what the RTC reads at the start, in unix time
+        self.rtc_s = rtc_s
+
+    def time(self):
+        return int(self.rtc_s + self.now)
+
+    def ticks_ms(self):
+        return int(self.now * 1000)
+
+    def ticks_us(self):
+        return int(self.now * 1000000)
+
+    def sleep(self, duration_s):
+        self.now += duration_s
+
+    def sleep_ms(self, duration_ms):
+        self.now += duration_ms / 1000
+
+    def sleep_us(self, duration_us):
+        self.now += duration_us / 1000000
+
+    def run(self, coroutine, duration_s=None):
+        """Runs coroutine until it returns, or is cancelled once duration_s
+        of simulated time has gone by."""
+        loop = asyncio.new_event_loop()
+        loop.time = lambda: self.now
+        select = loop._selector.select
+
+        def select_without_waiting(timeout=None):
+            events = select(0)
+            if not events and timeout:
+                self.now += timeout
+            return events
+
+        loop._selector.select = select_without_waiting
+        try:
+            task = loop.create_task(coroutine)
+            if duration_s is not None:
+                loop.call_at(self.now + duration_s, task.cancel)
+            try:
+                return loop.run_until_complete(task)
+            except asyncio.CancelledError:
+                return None
+        finally:
+            loop.close()
+
+
+class SCD41Model:
+    """SCD41 command set (datasheet section 3), with periodic, low power
+    periodic and single shot measurements and power down/wake up."""
+
+    address = 0x62
+    # command: (execution time ms, allowed during periodic measurement)
+    COMMANDS = {
+        0x21B1: (0, False),  # start_periodic_measurement
+        0x21AC: (0, False),  # start_low_power_periodic_measurement
+        0x3F86: (500, True),  # stop_periodic_measurement
+        0xEC05: (1, True),  # read_measurement
+        0xE4B8: (1, True),  # get_data_ready_status
+        0xE000: (1, True),  # set_ambient_pressure
+        0x241D: (1, False),  # set_temperature_offset
+        0x2318: (1, False),  # get_temperature_offset
+        0x2427: (1, False),  # set_sensor_altitude
+        0x2322: (1, False),  # get_sensor_altitude
+        0x2416: (1, False),  # set_automatic_self_calibration_enabled
+        0x2313: (1, False),  # get_automatic_self_calibration_enabled
+        0x3682: (1, False),  # get_serial_number
+        0x3639: (10000, False),  # perform_self_test
+        0x362F: (400, False),  # perform_forced_recalibration
+        0x3615: (800, False),  # persist_settings
+        0x3632: (1200, False),  # perform_factory_reset
+        0x3646: (20, False),  # reinit
+        0x219D: (5000, False),  # measure_single_shot
+        0x2196: (50, False),  # measure_single_shot_rht_only
+        0x36E0: (1, False),  # power_down
+        0x36F6: (20, False),  # wake_up
+    }
+    # the first single shot after waking up is off by this much
+    WAKE_UP_CO2_ERROR_PPM = 250
+
+    def __init__(self, clock, environment=default_environment):
+        self.clock = clock
+        self.environment = environment
+        self.serial_number = 0x0123456789AB
+        self.temperature_offset_raw = int(4 * 65536 / 175)
+        self.sensor_altitude = 0
+        self.asc_enabled = 1
+        self.ambient_pressure_hpa = None
+        self.mode = "idle"
+        self.measurement_interval_s = None
+        self.next_measurement_s = None
+        self.single_shot_rht_only = False
+        self.settled = True
+        self.measurement = None
+        self.data_ready = False
+        self.busy_until_s = 0
+        self.response = None
+        self.response_ready_s = 0
+        # counters for checking the drivers' behaviour
+        self.nacks = 0
+        self.crc_errors = 0
+        self.measurements = 0
+        self.commands = {}
+
+    @staticmethod
+    def crc8(data):
+        crc = 0xFF
+        for data_byte in data:
+            crc ^= data_byte
+            for _ in range(8):
+                crc = ((crc << 1) ^ 0x31 if crc & 0x80 else crc << 1) & 0xFF
+        return crc
+
+    def _words(self, *words):
+        response = bytearray()
+        for word in words:
+            word_bytes = (word & 0xFFFF).to_bytes(2, "big")
+            response += word_bytes + bytes([self.crc8(word_bytes)])
+        return bytes(response)
+
+    def _refuse(self):
+        self.nacks += 1
+        return _nack()
+
+    def _update(self):
+        # latches the measurements that have completed by now
+        now = self.clock.now
+        if self.next_measurement_s is None or now < self.next_measurement_s:
+            return
+        values = self.environment(self.next_measurement_s)
+        co2 = values["co2"]
+        if self.mode == "single_shot":
+            if self.single_shot_rht_only:
+                co2 = 0
+            elif not self.settled:
+                co2 += self.WAKE_UP_CO2_ERROR_PPM
+                self.settled = True
+            self.mode = "idle"
+            self.next_measurement_s = None
+        else:
+            while self.next_measurement_s <= now:
+                self.next_measurement_s += self.measurement_interval_s
+        self.measurement = (co2, values["celsius"], values["rh"])
+        self.data_ready = True
+        self.measurements += 1
+
+    def write(self, data):
+        now = self.clock.now
+        self._update()
+        command = int.from_bytes(data[:2], "big")
+        self.commands[command] = self.commands.get(command, 0) + 1
+
+        if command == 0x36F6:
+            # wake_up is never acknowledged, but does wake the sensor up
+            if self.mode == "sleep":
+                self.mode = "idle"
+                self.settled = False
+                self.busy_until_s = now + 0.02
+            raise self._refuse()
+        if (
+            self.mode == "sleep"
+            or now < self.busy_until_s
+            or command not in self.COMMANDS
+            or (self.mode == "periodic" and not self.COMMANDS[command][1])
+        ):
+            raise self._refuse()
+
+        arguments = []
+        for word_start in range(2, len(data), 3):
+            word_bytes = data[word_start : word_start + 2]
+            if len(word_bytes) < 2 or self.crc8(word_bytes) != data[word_start + 2]:
+                self.crc_errors += 1
+                raise self._refuse()
+            arguments.append(int.from_bytes(word_bytes, "big"))
+
+        execution_s = self.COMMANDS[command][0] / 1000
+        self.busy_until_s = now + execution_s
+        self.response = None
+        response = self._execute(command, arguments)
+        if response is not None:
+            self.response = response
+            self.response_ready_s = now + execution_s
+
+    def _execute(self, command, arguments):
+        now = self.clock.now
+        if command in (0x21B1, 0x21AC):
+            self.mode = "periodic"
+            self.measurement_interval_s = 5 if command == 0x21B1 else 30
+            self.next_measurement_s = now + self.measurement_interval_s
+        elif command == 0x3F86:
+            self.mode = "idle"
+            self.next_measurement_s = None
+        elif command == 0xEC05:
+            if not self.data_ready:
+                raise self._refuse()
+            self.data_ready = False
+            co2, celsius, rh = self.measurement
+            return self._words(
+                co2,
+                round((celsius + 45) * 65535 / 175),
+                round(rh * 65535 / 100),
+            )
+        elif command == 0xE4B8:
+            return self._words(0x8006 if self.data_ready else 0x8000)
+        elif command == 0xE000:
+            self.ambient_pressure_hpa = arguments[0]
+        elif command == 0x241D:
+            self.temperature_offset_raw = arguments[0]
+        elif command == 0x2318:
+            return self._words(self.temperature_offset_raw)
+        elif command == 0x2427:
+            self.sensor_altitude = arguments[0]
+        elif command == 0x2322:
+            return self._words(self.sensor_altitude)
+        elif command == 0x2416:
+            self.asc_enabled = arguments[0]
+        elif command == 0x2313:
+            return self._words(self.asc_enabled)
+        elif command == 0x3682:
+            return self._words(
+                self.serial_number >> 32, self.serial_number >> 16, self.serial_number
+            )
+        elif command == 0x3639:
+            return self._words(0)
+        elif command == 0x362F:
+            return self._words(0x8000)
+        elif command == 0x3632:
+            self.temperature_offset_raw = int(4 * 65536 / 175)
+            self.sensor_altitude = 0
+            self.asc_enabled = 1
+        elif command in (0x219D, 0x2196):
+            self.mode = "single_shot"
+            self.single_shot_rht_only = command == 0x2196
+            self.next_measurement_s = now + self.COMMANDS[command][0] / 1000
+        elif command == 0x36E0:
+            self.mode = "sleep"
+            self.data_ready = False
+        return None
+
+    def read(self, size):
+        self._update()
+        if self.response is None or self.clock.now < self.response_ready_s:
+            raise self._refuse()
+        response, self.response = self.response, None
+        return response[:size] + b"\xff" * (size - len(response))
+
+
+class RegisterDevice:
+    """A chip with 8 bit registers behind an auto incrementing pointer."""
+
+    def __init__(self, clock, environment=default_environment):
+        self.clock = clock
+        self.environment = environment
+        self.registers = bytearray(256)
+        self.pointer = 0
+        self.nacks = 0
+
+    def _update(self):
+        pass
+
+    def write_register(self, register, value):
+        self.registers[register] = value
+
+    def write(self, data):
+        self._update()
+        self.pointer = data[0]
+        for offset, value in enumerate(data[1:]):
+            self.write_register((self.pointer + offset) & 0xFF, value)
+
+    def read(self, size):
+        self._update()
+        data = bytes(self.registers[(self.pointer + i) & 0xFF] for i in range(size))
+        self.pointer = (self.pointer + size) & 0xFF
+        return data
+
+
+def _search_raw(compensate, target, low, high):
+    # the raw reading whose compensated value is closest to target, for a
+    # compensation that grows with the raw value
+    while low < high:
+        middle = (low + high) // 2
+        if compensate(middle) < target:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+class BMP280Model(RegisterDevice):
+    """BMP280 register map (datasheet section 4), with sleep, forced and
+    normal modes, oversampling and standby timings."""
+
+    address = 0x76
+    OVERSAMPLING = (0, 1, 2, 4, 8, 16)
+    STANDBY_MS = (0.5, 62.5, 125, 250, 500, 1000, 2000, 4000)
+
+    def __init__(self, clock, environment=default_environment):
+        super().__init__(clock, environment)
+        self.calibration = BMP280_CALIBRATION
+        for index, value in enumerate(self.calibration):
+            self.registers[0x88 + index * 2 : 0x8A + index * 2] = value.to_bytes(
+                2, "little", signed=index not in (0, 3)
+            )
+        self.registers[0xD0] = 0x58
+        self._reset()
+
+    def _reset(self):
+        self.registers[0xF3] = 0
+        self.registers[0xF4] = 0
+        self.registers[0xF5] = 0
+        self.registers[0xF7:0xFD] = b"\x80\x00\x00\x80\x00\x00"
+        self.conversion_done_s = None
+        self.conversions = 0
+
+    def _t_fine(self, adc_t):
+        T1, T2, T3 = self.calibration[:3]
+        var1 = (((adc_t >> 3) - (T1 << 1)) * T2) >> 11
+        var2 = (((((adc_t >> 4) - T1) * ((adc_t >> 4) - T1)) >> 12) * T3) >> 14
+        return var1 + var2
+
+    def _pressure(self, adc_p, t_fine):
+        P1, P2, P3, P4, P5, P6, P7, P8, P9 = self.calibration[3:]
+        var1 = t_fine - 128000
+        var2 = var1 * var1 * P6 + ((var1 * P5) << 17) + (P4 << 35)
+        var1 = ((var1 * var1 * P3) >> 8) + ((var1 * P2) << 12)
+        var1 = (((1 << 47) + var1) * P1) >> 33
+        p = 1048576 - adc_p
+        p = (((p << 31) - var2) * 3125) // var1
+        var1 = (P9 * (p >> 13) * (p >> 13)) >> 25
+        var2 = (P8 * p) >> 19
+        return (((p + var1 + var2) >> 8) + (P7 << 4)) / 256
+
+    def _measurement_ms(self):
+        ctrl_meas = self.registers[0xF4]
+        return (
+            1.25
+            + 2.3 * self.OVERSAMPLING[min(ctrl_meas >> 5, 5)]
+            + 2.3 * self.OVERSAMPLING[min((ctrl_meas >> 2) & 7, 5)]
+            + 0.575
+        )
+
+    def _convert(self, time_s):
+        ctrl_meas = self.registers[0xF4]
+        values = self.environment(time_s)
+        adc_t = _search_raw(
+            lambda raw: (self._t_fine(raw) * 5 + 128) >> 8,
+            round(values["celsius"] * 100),
+            0,
+            (1 << 20) - 1,
+        )
+        t_fine = self._t_fine(adc_t)
+        # pressure falls as the raw reading grows
+        adc_p = _search_raw(
+            lambda raw: -self._pressure(raw, t_fine),
+            -values["pressure_pa"],
+            0,
+            (1 << 20) - 1,
+        )
+        if not (ctrl_meas >> 2) & 7:
+            adc_p = 0x80000
+        if not ctrl_meas >> 5:
+            adc_t = 0x80000
+        self.registers[0xF7:0xFA] = (adc_p << 4).to_bytes(3, "big")
+        self.registers[0xFA:0xFD] = (adc_t << 4).to_bytes(3, "big")
+        self.conversions += 1
+
+    def _update(self):
+        now = self.clock.now
+        mode = self.registers[0xF4] & 3
+        if self.conversion_done_s is not None and self.conversion_done_s <= now:
+            if mode == 3:
+                # only the latest of the conversions since the last access shows
+                period_s = (
+                    self._measurement_ms() + self.STANDBY_MS[self.registers[0xF5] >> 5]
+                ) / 1000
+                missed = int((now - self.conversion_done_s) / period_s)
+                self._convert(self.conversion_done_s + missed * period_s)
+                self.conversions += missed
+                self.conversion_done_s += (missed + 1) * period_s
+            else:
+                self._convert(self.conversion_done_s)
+                # forced mode goes back to sleep once done
+                self.registers[0xF4] &= 0xFC
+                self.conversion_done_s = None
+        measuring = self.conversion_done_s is not None and (
+            mode != 3 or self.conversion_done_s - now < self._measurement_ms() / 1000
+        )
+        self.registers[0xF3] = 0x08 if measuring else 0
+
+    def write_register(self, register, value):
+        if register == 0xE0:
+            if value == 0xB6:
+                self._reset()
+            return
+        if register not in (0xF4, 0xF5):
+            # everything else is read only
+            return
+        self.registers[register] = value
+        if register == 0xF4:
+            if value & 3:
+                self.conversion_done_s = self.clock.now + self._measurement_ms() / 1000
+            else:
+                self.conversion_done_s = None
+
+
+class BMP180Model(RegisterDevice):
+    """BMP180 register map (datasheet section 5), with temperature and
+    pressure conversions at each oversampling setting."""
+
+    address = 0x77
+    PRESSURE_CONVERSION_MS = (4.5, 7.5, 13.5, 25.5)
+
+    def __init__(self, clock, environment=default_environment):
+        super().__init__(clock, environment)
+        self.calibration = dict(
+            zip(
+                ("AC1", "AC2", "AC3", "AC4", "AC5", "AC6")
+                + ("B1", "B2", "MB", "MC", "MD"),
+                BMP180_CALIBRATION,
+            )
+        )
+        for index, value in enumerate(BMP180_CALIBRATION):
+            self.registers[0xAA + index * 2 : 0xAC + index * 2] = value.to_bytes(
+                2, "big", signed=index not in (3, 4, 5)
+            )
+        self.registers[0xD0] = 0x55
+        self.conversion = None
+        self.conversion_done_s = None
+        self.conversions = 0
+
+    def _b5(self, ut):
+        c = self.calibration
+        x1 = ((ut - c["AC6"]) * c["AC5"]) >> 15
+        return x1 + (c["MC"] << 11) // (x1 + c["MD"])
+
+    def _pressure(self, up, b5, oss):
+        c = self.calibration
+        b6 = b5 - 4000
+        x3 = ((c["B2"] * ((b6 * b6) >> 12)) >> 11) + ((c["AC2"] * b6) >> 11)
+        b3 = (((c["AC1"] * 4 + x3) << oss) + 2) >> 2
+        x1 = (c["AC3"] * b6) >> 13
+        x2 = (c["B1"] * ((b6 * b6) >> 12)) >> 16
+        b4 = (c["AC4"] * (((x1 + x2 + 2) >> 2) + 32768)) >> 15
+        b7 = (up - b3) * (50000 >> oss)
+        p = (b7 * 2) // b4 if b7 < 0x80000000 else (b7 // b4) * 2
+        x1 = (((p >> 8) * (p >> 8)) * 3038) >> 16
+        x2 = (-7357 * p) >> 16
+        return p + ((x1 + x2 + 3791) >> 4)
+
+    def _update(self):
+        if self.conversion_done_s is None or self.clock.now < self.conversion_done_s:
+            return
+        values = self.environment(self.conversion_done_s)
+        # B5 only grows with UT past the pole where X1 + MD crosses zero
+        c = self.calibration
+        ut_min = c["AC6"] - (c["MD"] << 15) // c["AC5"] + 1
+        ut = _search_raw(
+            lambda raw: (self._b5(raw) + 8) >> 4,
+            round(values["celsius"] * 10),
+            ut_min,
+            0xFFFF,
+        )
+        if self.conversion == 0x2E:
+            self.registers[0xF6:0xF8] = ut.to_bytes(2, "big")
+        else:
+            oss = self.conversion >> 6
+            b5 = self._b5(ut)
+            up = _search_raw(
+                lambda raw: self._pressure(raw, b5, oss),
+                values["pressure_pa"],
+                0,
+                (1 << (16 + oss)) - 1,
+            )
+            self.registers[0xF6:0xF9] = (up << (8 - oss)).to_bytes(3, "big")
+        self.registers[0xF4] &= ~0x20 & 0xFF
+        self.conversion_done_s = None
+        self.conversions += 1
+
+    def write_register(self, register, value):
+        if register == 0xE0:
+            if value == 0xB6:
+                self.registers[0xF4] = 0
+                self.conversion_done_s = None
+            return
+        if register != 0xF4:
+            return
+        # both conversion commands include the start of conversion bit, which
+        # stays set until the result is in
+        self.registers[0xF4] = value
+        if value == 0x2E:
+            conversion_ms = 4.5
+        elif value & 0x3F == 0x34:
+            conversion_ms = self.PRESSURE_CONVERSION_MS[value >> 6]
+        else:
+            return
+        self.conversion = value
+        self.conversion_done_s = self.clock.now + conversion_ms / 1000
+
+
+class SimulatedI2C:
+    """The parts of machine.I2C/SoftI2C that the drivers use. Every
+    transaction takes as long as its bits would at frequency, and fails with
+    EIO at error_rate."""
+
+    def __init__(self, clock, devices, frequency=100000, error_rate=0, seed=0):
+        self.clock = clock
+        self.devices = {device.address: device for device in devices}
+        self.frequency = frequency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.transactions = 0
+        self.injected_errors = 0
+
+    def _device(self, address, size):
+        # address byte and data bytes, each with its ack bit
+        self.clock.sleep((size + 1) * 9 / self.frequency)
+        self.transactions += 1
+        if address not in self.devices:
+            raise _nack()
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.injected_errors += 1
+            raise OSError(errno.EIO, "injected error")
+        return self.devices[address]
+
+    def scan(self):
+        return sorted(self.devices)
+
+    def writeto(self, address, data, stop=True):
+        self._device(address, len(data)).write(bytes(data))
+        return len(data)
+
+    def readfrom(self, address, size, stop=True):
+        return self._device(address, size).read(size)
+
+    def readfrom_mem(self, address, register, size, addrsize=8):
+        device = self._device(address, size + 2)
+        device.write(bytes([register]))
+        return device.read(size)
+
+    def writeto_mem(self, address, register, data, addrsize=8):
+        self._device(address, len(data) + 1).write(bytes([register]) + bytes(data))
+
+
+class Simulation:
+    def __init__(self, clock, bus, panel):
+        self.clock = clock
+        self.bus = bus
+        self.panel = panel
+
+
+def install(
+    config_overrides=None,
+    environment=default_environment,
+    pressure_sensor="bmp280",
+    error_rate=0,
+    seed=0,
+    work_dir=None,
+):
+    """Installs display_emulator's stubs, with the simulated bus and clock on
+    top. pressure_sensor is "bmp280", "bmp180" or None."""
+    panel = display_emulator.install(config_overrides, work_dir=work_dir)
+    clock = VirtualClock()
+    devices = [SCD41Model(clock, environment)]
+    if pressure_sensor == "bmp280":
+        devices.append(BMP280Model(clock, environment))
+    elif pressure_sensor == "bmp180":
+        devices.append(BMP180Model(clock, environment))
+    bus = SimulatedI2C(clock, devices, error_rate=error_rate, seed=seed)
+
+    machine = sys.modules["machine"]
+    machine.I2C = machine.SoftI2C = lambda *args, **kwargs: bus
+    machine.lightsleep = clock.sleep_ms
+
+    utime = types.ModuleType("utime")
+    for name in ("time", "ticks_ms", "ticks_us", "sleep", "sleep_ms", "sleep_us"):
+        setattr(utime, name, getattr(clock, name))
+    utime.gmtime = time.gmtime
+    utime.ticks_diff = lambda new, old: new - old
+    utime.ticks_add = lambda ticks, delta: ticks + delta
+    sys.modules["utime"] = utime
+
+    sys.modules["uasyncio"].run = lambda coroutine: clock.run(coroutine)
+
+    class WLAN:
+        # never connects, main.py only gets as far as switching it on and off
+        def __init__(self, interface_id):
+            self._active = False
+
+        def active(self, is_active=None):
+            if is_active is None:
+                return self._active
+            self._active = bool(is_active)
+
+        def isconnected(self):
+            return False
+
+        def connect(self, ssid, password):
+            pass
+
+    sys.modules["network"].WLAN = WLAN
+    # only imported for influx, which the simulation doesn't talk to
+    sys.modules["urequests"] = types.ModuleType("urequests")
+
+    return Simulation(clock, bus, panel)
@@ -1,9 +1,31 @@
-import sys
-import struct
+"""Prints the datapoints in a log file from the device.
 
-with open(sys.argv[1], "rb") as f:
-    log_file = f.read()
+usage: python3 logparser.py co2.log [--from 2026-01-01T00:00] [--to ...]
+
+Reads plain .log files, in both log formats, and .ring files. The combined
+log is printed as a table of all channels, comma separated. --from and --to
+(UTC, or unix time) only pick from v2 frames stamped once the device's clock
+was set, and use logs/<channel>.idx next to a plain log, or the ring's slots,
+to skip to the start of the range. Frames from before the clock was set
+count time from their boot and are left out of a range.
+"""
+
+import argparse
+import datetime
+import os
+import struct
 
+# ring files, see RingLog in esp32/sensor_log.py
+RING_VERSION = 2
+RING_HEADER_FORMAT = ">4sBBHIII"
+RING_SLOT_HEADER_FORMAT = ">IH"
+# v2 frames and the plain log's index, see esp32/sensor_log.py
+FRAME_FORMAT = ">4sBBHIHH"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_FORMAT) + 1
+FRAME_FLAG_UNIX_TIME = 0x01
+FRAME_FLAG_SESSION_START = 0x02
+FRAME_FLAG_DELTA = 0x04
+INDEX_FORMAT = ">II"
 
 DATA_SIZE_TO_STRUCT = {2: ">H", 3: ">I"}
 DATA_FORMAT_ID = {
@@ -12,36 +34,329 @@ DATA_FORMAT_ID = {
     0x02: {"name": "Relative Humidity", "suffix": "%", "size": 2, "divide": 100},
     0x03: {"name": "Pressure", "suffix": "Pa", "size": 3, "divide": 10},
 }
+# records of a byte of flags for which of the above are there, then those
+COMBINED_FORMAT_ID = 0x04
+
+
+def calc_crc8(data: bytes) -> int:
+    # the SCD41's CRC-8, polynomial 0x31
+    crc = 0xFF
+    for data_byte in data:
+        crc ^= data_byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x31 if crc & 0x80 else crc << 1) & 0xFF
+    return crc
+
+
+def parse_time(value: str) -> int:
+    if value.isdigit():
+        return int(value)
+    return int(
+        datetime.datetime.fromisoformat(value)
+        .replace(tzinfo=datetime.timezone.utc)
+        .timestamp()
+    )
+
+
+def read_frame_header(log: bytes, offset: int):
+    # (format id, flags, interval, timestamp, samples, payload bytes) if a
+    # valid v2 frame starts at offset, otherwise None
+    header = log[offset : offset + FRAME_HEADER_SIZE - 1]
+    if (
+        len(header) < FRAME_HEADER_SIZE - 1
+        or calc_crc8(header) != log[offset + FRAME_HEADER_SIZE - 1]
+    ):
+        return None
+    _, format_byte, *fields = struct.unpack(FRAME_FORMAT, header)
+    if not format_byte & 0x80 or (
+        format_byte & 0x7F not in DATA_FORMAT_ID
+        and format_byte & 0x7F != COMBINED_FORMAT_ID
+    ):
+        return None
+    return (format_byte & 0x7F, *fields)
+
+
+def next_frame(log: bytes, offset: int) -> int:
+    # the offset of the next valid v2 frame from offset on, -1 if none
+    offset = log.find(b"AN42", offset)
+    while offset != -1 and read_frame_header(log, offset) is None:
+        offset = log.find(b"AN42", offset + 1)
+    return offset
+
+
+def read_ring(ring_file: bytes, start_time: int | None) -> bytes:
+    # joins the slots oldest first, from the last slot starting before
+    # start_time if given
+    _, version, _, slot_bytes, slot_count, _, _ = struct.unpack_from(
+        RING_HEADER_FORMAT, ring_file
+    )
+    if version != RING_VERSION:
+        raise ValueError(f"unsupported ring file version {version}")
+    header_size = struct.calcsize(RING_HEADER_FORMAT)
+    slot_header_size = struct.calcsize(RING_SLOT_HEADER_FORMAT)
+    slots = []
+    for slot in range(slot_count):
+        offset = header_size + slot * slot_bytes
+        sequence, used = struct.unpack_from(RING_SLOT_HEADER_FORMAT, ring_file, offset)
+        if sequence:
+            payload_start = offset + slot_header_size
+            slots.append((sequence, ring_file[payload_start : payload_start + used]))
+    slots.sort()
+
+    if start_time is not None:
+        # slots start with a frame, so this only needs their headers
+        while len(slots) > 1:
+            frame = read_frame_header(slots[1][1], 0)
+            if (
+                frame is None
+                or not frame[1] & FRAME_FLAG_UNIX_TIME
+                or frame[3] > start_time
+            ):
+                break
+            slots.pop(0)
+
+    return b"".join(slot[1] for slot in slots)
+
+
+def index_offset(index_path: str, start_time: int) -> int:
+    # the last indexed frame before start_time, 0 if there's no index or
+    # it can't be searched, as the clock went backwards
+    if not os.path.exists(index_path):
+        return 0
+    with open(index_path, "rb") as f:
+        index = list(struct.iter_unpack(INDEX_FORMAT, f.read()))
+    if any(
+        later[0] < earlier[0] or later[1] < earlier[1]
+        for earlier, later in zip(index, index[1:])
+    ):
+        return 0
+    offset = 0
+    for timestamp, frame_offset in index:
+        if timestamp > start_time:
+            break
+        offset = frame_offset
+    return offset
 
-parsed_data = ""
 
-sessions = log_file.split(b"AN42")
+def datapoint_value(data_format: dict, rel_bytes: bytes) -> float:
+    if data_format["size"] == 3:
+        rel_bytes = bytes(1) + rel_bytes
+    return (
+        struct.unpack(DATA_SIZE_TO_STRUCT[data_format["size"]], rel_bytes)[0]
+        / data_format["divide"]
+    )
 
-session_counter = 0
-for session in sessions:
-    if not session:
-        continue
-    session_low_power = False
+
+def record_fields(format_id: int, first_byte: int) -> list[int]:
+    # the sizes of the values in each record of a frame, see record_fields
+    # in esp32/sensor_log.py
+    if format_id != COMBINED_FORMAT_ID:
+        return [DATA_FORMAT_ID[format_id]["size"]]
+    return [1] + [
+        data_format["size"]
+        for data_format_id, data_format in DATA_FORMAT_ID.items()
+        if first_byte & (1 << data_format_id)
+    ]
+
+
+def split_record(record: bytes, fields: list[int]) -> list[bytes]:
+    values = []
+    for size in fields:
+        values.append(record[:size])
+        record = record[size:]
+    return values
+
+
+def delta_decode(
+    payload: bytes, fields: list[int], samples: int, fixed: int = 0
+) -> list[list]:
+    # the first record, then a zigzag varint delta for each of its values in
+    # every record after, see FRAME_FLAG_DELTA. The first fixed values are
+    # the same in every record and only in the first, like the combined
+    # log's channel byte.
+    record = split_record(payload[: sum(fields)], fields)
+    values = [int.from_bytes(value, "big") for value in record]
+    records = [record]
+    deltas = []
+    delta = shift = 0
+    for payload_byte in payload[sum(fields) :]:
+        delta |= (payload_byte & 0x7F) << shift
+        shift += 7
+        if payload_byte & 0x80:
+            continue
+        deltas.append(delta >> 1 if not delta & 1 else -((delta + 1) >> 1))
+        delta = shift = 0
+    delta_fields = len(fields) - fixed
+    for i in range(0, len(deltas) - delta_fields + 1, delta_fields):
+        record = records[0][:fixed]
+        for field in range(fixed, len(fields)):
+            values[field] += deltas[i + field - fixed]
+            record.append(values[field].to_bytes(fields[field], "big"))
+        records.append(record)
+    return records[:samples]
+
+
+def combined_row(record: list[bytes]) -> str:
+    # a value for each channel, empty if the record doesn't have it
+    row = []
+    values = iter(record[1:])
+    for data_format_id, data_format in DATA_FORMAT_ID.items():
+        if record[0][0] & (1 << data_format_id):
+            row.append(str(datapoint_value(data_format, next(values))))
+        else:
+            row.append("")
+    return ",".join(row)
+
+
+def parse_v1_session(session: bytes) -> str:
     datapoint_counter = 0
-    session_counter += 1
     data_format = DATA_FORMAT_ID[session[0]]
     data_size = data_format["size"]
-    session_low_power = bool(session[1])
-
-    parsed_data += f"Session {session_counter} ({data_format['name']})\n"
+    # interval flag: 0 is 5s, 1 is 30s (low power), 2 is followed by the interval
+    if session[1] == 2:
+        session_interval = struct.unpack(">H", session[2:4])[0]
+        header_size = 4
+    else:
+        session_interval = 30 if session[1] else 5
+        header_size = 2
+    # the header is padded to whole datapoints
+    header_size += -header_size % data_size
 
-    for i in range(1, int(len(session) / data_size)):
-        rel_bytes = session[i * data_size : (i + 1) * data_size]
-        if data_size == 3:
-            rel_bytes = bytes(1) + rel_bytes
-        datapoint = (
-            struct.unpack(DATA_SIZE_TO_STRUCT[data_size], rel_bytes)[0]
-            / data_format["divide"]
+    parsed_data = ""
+    for i in range(header_size // data_size, int(len(session) / data_size)):
+        datapoint = datapoint_value(
+            data_format, session[i * data_size : (i + 1) * data_size]
         )
-        passed_time = datapoint_counter * (30 if session_low_power else 5)
+        passed_time = datapoint_counter * session_interval
         parsed_data += f"+{passed_time}: {datapoint}{data_format['suffix']}\n"
         datapoint_counter += 1
+    return parsed_data
+
+
+def parse_log(
+    log: bytes, start_time: int | None = None, end_time: int | None = None
+) -> str:
+    parsed_data = ""
+    session_counter = 0
+    # format id and first timestamp of the v2 session being printed
+    v2_session = None
+
+    offset = log.find(b"AN42")
+    while offset != -1 and offset + 4 < len(log):
+        if log[offset + 4] & 0x80:
+            frame = read_frame_header(log, offset)
+            if frame is None:
+                # a sync marker that happens to be in the data
+                offset = log.find(b"AN42", offset + 1)
+                continue
+            format_id, flags, interval_s, timestamp, samples, payload_bytes = frame
+            payload_start = offset + FRAME_HEADER_SIZE
+            if samples:
+                offset = log.find(b"AN42", payload_start + payload_bytes)
+            else:
+                # written while still open, it runs up to the next frame
+                offset = next_frame(log, payload_start)
+                payload_bytes = (offset if offset != -1 else len(log)) - payload_start
+            if (start_time is not None or end_time is not None) and not (
+                flags & FRAME_FLAG_UNIX_TIME
+            ):
+                # only counts from its boot, can't be placed in the range
+                continue
+            if end_time is not None and timestamp > end_time:
+                continue
+
+            if (
+                flags & FRAME_FLAG_SESSION_START
+                or v2_session is None
+                or v2_session[0] != format_id
+            ):
+                session_counter += 1
+                v2_session = (format_id, timestamp)
+                if format_id == COMBINED_FORMAT_ID:
+                    # a joined table of all channels
+                    parsed_data += f"Session {session_counter} (Combined)\n"
+                    parsed_data += ",".join(
+                        ["time"]
+                        + [
+                            f"{data_format['name']} ({data_format['suffix']})"
+                            for data_format in DATA_FORMAT_ID.values()
+                        ]
+                    )
+                    parsed_data += "\n"
+                else:
+                    data_format = DATA_FORMAT_ID[format_id]
+                    parsed_data += (
+                        f"Session {session_counter} ({data_format['name']})\n"
+                    )
+            payload = log[payload_start : payload_start + payload_bytes]
+            if not payload:
+                continue
+            fields = record_fields(format_id, payload[0])
+            record_size = sum(fields)
+            if flags & FRAME_FLAG_DELTA:
+                records = delta_decode(
+                    payload,
+                    fields,
+                    samples or len(payload),
+                    1 if format_id == COMBINED_FORMAT_ID else 0,
+                )
+            else:
+                records = [
+                    split_record(
+                        payload[i * record_size : (i + 1) * record_size], fields
+                    )
+                    for i in range(samples or payload_bytes // record_size)
+                ]
+            for i, record in enumerate(records):
+                sample_time = timestamp + i * interval_s
+                if start_time is not None and sample_time < start_time:
+                    continue
+                if end_time is not None and sample_time > end_time:
+                    break
+                if flags & FRAME_FLAG_UNIX_TIME:
+                    when = datetime.datetime.fromtimestamp(
+                        sample_time, datetime.timezone.utc
+                    ).strftime("%Y-%m-%d %H:%M:%S")
+                else:
+                    # the clock wasn't set, only time since the session started
+                    when = f"+{sample_time - v2_session[1]}"
+                if format_id == COMBINED_FORMAT_ID:
+                    parsed_data += f"{when},{combined_row(record)}\n"
+                else:
+                    data_format = DATA_FORMAT_ID[format_id]
+                    datapoint = datapoint_value(data_format, record[0])
+                    parsed_data += f"{when}: {datapoint}{data_format['suffix']}\n"
+        else:
+            # v1 sessions run until the next sync marker, wherever it is
+            end = log.find(b"AN42", offset + 4)
+            session = log[offset + 4 : end if end != -1 else len(log)]
+            offset = end
+            v2_session = None
+            # no timestamps to filter by
+            if start_time is not None or end_time is not None:
+                continue
+            session_counter += 1
+            data_format = DATA_FORMAT_ID[session[0]]
+            parsed_data += f"Session {session_counter} ({data_format['name']})\n"
+            parsed_data += parse_v1_session(session)
+
+    return parsed_data.strip()
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("log")
+parser.add_argument("--from", dest="start", type=parse_time)
+parser.add_argument("--to", dest="end", type=parse_time)
+args = parser.parse_args()
+
+with open(args.log, "rb") as f:
+    log_file = f.read()
 
-parsed_data = parsed_data.strip()
+if log_file.startswith(b"AR42"):
+    log_file = read_ring(log_file, args.start)
+elif args.start is not None:
+    log_file = log_file[
+        index_offset(os.path.splitext(args.log)[0] + ".idx", args.start) :
+    ]
 
-print(parsed_data)
+print(parse_log(log_file, args.start, args.end))
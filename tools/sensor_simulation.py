@@ -0,0 +1,148 @@
+"""Runs main.py's sensor_task end to end on the simulated I2C bus.
+
+usage: python3 sensor_simulation.py [--minutes 30] [--pressure-sensor bmp280]
+           [--environment recording.csv --step 5] [--error-rate 0.01]
+           [--allocations] [config overrides as json]
+e.g.   python3 sensor_simulation.py --minutes 60 '{"scd41": {"low_power": false}}'
+
+Time is simulated (see i2c_simulator), so an hour of readings takes seconds.
+Each cycle is timed from the SCD41 having data ready to the loop waiting for
+the next reading, in host time. --allocations traces the peak allocated
+bytes over each cycle too, which slows everything down.
+
+Bluetooth, WLAN and the web server are off unless the overrides turn them on.
+The logs end up in the printed working directory.
+"""
+
+import __future__
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import i2c_simulator
+
+parser = argparse.ArgumentParser()
+parser.add_argument("overrides", nargs="?", default="{}")
+parser.add_argument("--minutes", type=float, default=30)
+parser.add_argument(
+    "--pressure-sensor", choices=("bmp280", "bmp180", "none"), default="bmp280"
+)
+parser.add_argument("--environment", help="csv recording, see i2c_simulator")
+parser.add_argument("--step", type=float, default=5, help="seconds per csv row")
+parser.add_argument("--error-rate", type=float, default=0)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--allocations", action="store_true")
+args = parser.parse_args()
+
+overrides = {
+    "debug": 0,
+    "bluetooth": {"enabled": False},
+    "wlan": {"enabled": False},
+    "webserver": {"enabled": False},
+    "influx": {"enabled": False},
+}
+i2c_simulator.display_emulator._merge(overrides, json.loads(args.overrides))
+simulation = i2c_simulator.install(
+    overrides,
+    environment=(
+        i2c_simulator.recorded_environment(args.environment, args.step)
+        if args.environment
+        else i2c_simulator.default_environment
+    ),
+    pressure_sensor=None if args.pressure_sensor == "none" else args.pressure_sensor,
+    error_rate=args.error_rate,
+    seed=args.seed,
+)
+os.makedirs("logs", exist_ok=True)
+
+import helpers  # noqa: E402
+import scd41  # noqa: E402
+import sensor_log  # noqa: E402
+
+cycle_ms = []
+cycle_bytes = []
+reading_times_s = []
+cycle_start = None
+wait_for_data_ready = scd41.SCD41.wait_for_data_ready
+
+
+async def timed_wait_for_data_ready(self):
+    # a cycle runs from one reading being ready to waiting for the next one
+    global cycle_start
+    if cycle_start is not None:
+        cycle_ms.append((time.perf_counter() - cycle_start) * 1000)
+        if args.allocations:
+            cycle_bytes.append(tracemalloc.get_traced_memory()[1] - cycle_start_bytes)
+    await wait_for_data_ready(self)
+    reading_times_s.append(simulation.clock.now)
+    start_cycle()
+
+
+def start_cycle():
+    global cycle_start, cycle_start_bytes
+    if args.allocations:
+        tracemalloc.reset_peak()
+        cycle_start_bytes = tracemalloc.get_traced_memory()[0]
+    cycle_start = time.perf_counter()
+
+
+scd41.SCD41.wait_for_data_ready = timed_wait_for_data_ready
+sys.modules["uasyncio"].run = lambda coroutine: simulation.clock.run(
+    coroutine, duration_s=args.minutes * 60
+)
+
+if args.allocations:
+    tracemalloc.start()
+start = time.perf_counter()
+with open(os.path.join(i2c_simulator.display_emulator.ESP32_DIR, "main.py")) as f:
+    # micropython doesn't evaluate annotations, main.py's can name optional imports
+    main_code = compile(
+        f.read(), "main.py", "exec", flags=__future__.annotations.compiler_flag
+    )
+exec(main_code, {"__name__": "__main__"})
+host_s = time.perf_counter() - start
+
+
+def summary(values, unit):
+    values = sorted(values)
+    return (
+        f"mean={sum(values) / len(values):.3f}{unit} "
+        f"median={values[len(values) // 2]:.3f}{unit} max={values[-1]:.3f}{unit}"
+    )
+
+
+print(
+    f"simulated {simulation.clock.now / 60:.1f} minutes in {host_s:.2f}s, "
+    f"{len(reading_times_s)} readings"
+)
+if len(reading_times_s) > 1:
+    intervals = [b - a for a, b in zip(reading_times_s, reading_times_s[1:])]
+    print(f"reading interval: {summary(intervals, 's')}")
+if cycle_ms:
+    print(f"cycle host time: {summary(cycle_ms, 'ms')}")
+if cycle_bytes:
+    print(f"cycle peak allocations: {summary(cycle_bytes, 'B')}")
+
+scd41_model = simulation.bus.devices[0x62]
+print(
+    f"scd41: {scd41_model.measurements} measurements, {scd41_model.nacks} nacks, "
+    f"{scd41_model.crc_errors} crc errors, "
+    f"ambient pressure {scd41_model.ambient_pressure_hpa}hPa"
+)
+print(
+    f"bus: {simulation.bus.transactions} transactions, "
+    f"{simulation.bus.injected_errors} injected errors"
+)
+for key, value in helpers.i2c_stats_status().items():
+    if not key.split("_", 2)[2].startswith("latency"):
+        print(f"  {key}: {value}")
+print(f"panel refreshes: {len(simulation.panel.frames)}")
+for key, value in sensor_log.log_stats_status().items():
+    print(f"  {key}: {value}")
+for filename in sorted(os.listdir("logs")):
+    size = os.path.getsize(os.path.join("logs", filename))
+    print(f"logs/{filename}: {size} bytes")
+print("working directory:", os.getcwd())